@@ -1,13 +1,19 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
-from sqlalchemy import or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import or_, select
 
-from app.database import SessionLocal, get_db
+from app.cache import token_cache, principal_cache, invalidate_principal
+from app.metrics import add_request_time
+from app.database import get_async_db
 import app.models as models
 import app.schemas as schemas
 
@@ -15,29 +21,67 @@ SECRET_KEY = "your-secret-key-keep-it-secret"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", 2))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", 64))
+# Служебные эндпоинты /admin/* доступны только этим пользователям; по умолчанию - никому
+ADMIN_USERNAMES = frozenset(name.strip() for name in os.getenv("ADMIN_USERNAMES", "").split(",") if name.strip())
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# bcrypt отпускает GIL, поэтому хватает потоков; размер пула ограничивает долю CPU под хеширование
+_password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+_pending_password_jobs = 0
+
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
 def get_password_hash(password):
     return pwd_context.hash(password)
 
-def get_user(db: Session, username: str):
-    return db.query(models.User).filter(
+async def _run_password_job(func, *args):
+    # Сверх PASSWORD_HASH_MAX_PENDING ожидающих запросов сразу отвечаем 503, а не растим очередь
+    global _pending_password_jobs
+    if _pending_password_jobs >= PASSWORD_HASH_MAX_PENDING:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many authentication requests, try again later",
+            headers={"Retry-After": "1"},
+        )
+    _pending_password_jobs += 1
+    started = time.perf_counter()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_password_executor, func, *args)
+    finally:
+        _pending_password_jobs -= 1
+        add_request_time("password", time.perf_counter() - started)
+
+async def hash_password(password: str) -> str:
+    return await _run_password_job(pwd_context.hash, password)
+
+async def verify_and_update_password(plain_password: str, hashed_password: str):
+    """Проверяет пароль в пуле потоков; второй элемент - новый хеш, если сменился BCRYPT_ROUNDS."""
+    return await _run_password_job(pwd_context.verify_and_update, plain_password, hashed_password)
+
+async def get_user(db: AsyncSession, username: str):
+    return await db.scalar(select(models.User).where(
         or_(
             models.User.username == username,
             models.User.email == username
         )
-    ).first()
+    ))
 
-def authenticate_user(db: Session, username: str, password: str):
-    user = get_user(db, username)
+async def authenticate_user(db: AsyncSession, username: str, password: str):
+    user = await get_user(db, username)
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    valid, new_hash = await verify_and_update_password(password, user.hashed_password)
+    if not valid:
         return False
+    if new_hash:
+        user.hashed_password = new_hash
+        await db.commit()
     return user
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -50,27 +94,64 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+def decode_token_subject(token: str) -> Optional[str]:
+    # Проверенный токен запоминается до истечения его срока, повторная проверка подписи не нужна
+    username = token_cache.get(token)
+    if username is not None:
+        return username
+    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    username = payload.get("sub")
+    if username is None:
+        return None
+    exp = payload.get("exp")
+    token_cache.set(token, username, ttl=exp - time.time() if exp else None)
+    return username
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
+    """Возвращает пользователя токена как schemas.User.
+
+    Пользователь берётся из principal_cache (TTL PRINCIPAL_CACHE_TTL), в БД идём
+    только при промахе; после изменения пользователя нужен invalidate_principal.
+    """
+    started = time.perf_counter()
+    try:
+        return await _current_user(token, db)
+    finally:
+        add_request_time("auth", time.perf_counter() - started)
+
+async def _current_user(token: str, db: AsyncSession):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-        token_data = schemas.TokenData(username=username)
+        username = decode_token_subject(token)
     except JWTError:
         raise credentials_exception
-    
-    user = get_user(db, username=token_data.username)
-    if user is None:
+    if username is None:
         raise credentials_exception
+
+    user = principal_cache.get(username)
+    if user is None:
+        db_user = await get_user(db, username=username)
+        if db_user is None:
+            raise credentials_exception
+        user = schemas.User.model_validate(db_user)
+        principal_cache.set(username, user)
     return user
 
+async def set_user_active(db: AsyncSession, user: models.User, is_active: bool) -> None:
+    user.is_active = is_active
+    await db.commit()
+    await invalidate_principal(user.username)
+
 async def get_current_active_user(current_user: models.User = Depends(get_current_user)):
     if not current_user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
-    return current_user 
\ No newline at end of file
+    return current_user
+
+async def get_current_admin_user(current_user: models.User = Depends(get_current_active_user)):
+    if current_user.username not in ADMIN_USERNAMES:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+    return current_user
@@ -0,0 +1,25 @@
+import hashlib
+import math
+from typing import List
+
+_MASK64 = 0xFFFFFFFFFFFFFFFF
+
+class BloomFilter:
+    """Параметры фильтра Блума: размер битовой карты и номера битов ключа.
+
+    Сами биты хранятся в Redis (SETBIT/GETBIT), здесь только арифметика,
+    поэтому все процессы с одинаковыми capacity и error_rate смотрят в одни и те же биты.
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(64, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+
+    def offsets(self, key: str) -> List[int]:
+        # Двойное хеширование (Kirsch-Mitzenmacher): k позиций из одного 128-битного дайджеста
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "big")
+        h2 = int.from_bytes(digest[8:], "big") | 1
+        return [((h1 + i * h2) & _MASK64) % self.size for i in range(self.hashes)]
@@ -1,43 +1,668 @@
-import json
-import redis
-from datetime import datetime
-from typing import Optional, Dict, Any
-
-redis_client = redis.Redis(
-    host='localhost',
-    port=6379,
-    db=0,
-    decode_responses=True
+import asyncio
+import math
+import os
+import time
+import logging
+import redis.asyncio as redis
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from redis.exceptions import RedisError
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+from typing import Optional, Callable, Dict, Any, AsyncIterator, Iterable, List, Tuple, Union
+
+from app.bloom import BloomFilter
+from app.local_cache import LocalCache
+from app.metrics import CACHE_LOOKUPS, REDIS_COMMAND_DURATION, add_request_time
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+class InstrumentedPipeline(redis.client.Pipeline):
+    async def execute(self, raise_on_error: bool = True):
+        started = time.perf_counter()
+        try:
+            return await super().execute(raise_on_error)
+        finally:
+            elapsed = time.perf_counter() - started
+            REDIS_COMMAND_DURATION.labels("PIPELINE").observe(elapsed)
+            add_request_time("redis", elapsed)
+
+class InstrumentedRedis(redis.Redis):
+    """Клиент, который пишет время каждого обращения к Redis в redis_command_duration_seconds."""
+
+    async def execute_command(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            elapsed = time.perf_counter() - started
+            REDIS_COMMAND_DURATION.labels(str(args[0]).upper()).observe(elapsed)
+            add_request_time("redis", elapsed)
+
+    def pipeline(self, transaction: bool = True, shard_hint: Optional[str] = None) -> InstrumentedPipeline:
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+def create_redis_pool(**overrides) -> redis.BlockingConnectionPool:
+    options = dict(
+        host=os.getenv("REDIS_HOST", "localhost"),
+        port=int(os.getenv("REDIS_PORT", 6379)),
+        db=int(os.getenv("REDIS_DB", 0)),
+        max_connections=int(os.getenv("REDIS_MAX_CONNECTIONS", 50)),
+        timeout=float(os.getenv("REDIS_POOL_TIMEOUT", 1.0)),
+        socket_timeout=float(os.getenv("REDIS_SOCKET_TIMEOUT", 0.5)),
+        socket_connect_timeout=float(os.getenv("REDIS_CONNECT_TIMEOUT", 1.0)),
+        health_check_interval=int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", 30)),
+        decode_responses=True
+    )
+    options.update(overrides)
+    return redis.BlockingConnectionPool(**options)
+
+redis_pool = create_redis_pool()
+redis_client = InstrumentedRedis(connection_pool=redis_pool)
+
+# Клиент текущего запуска задачи Celery. Пул привязан к event loop (его блокировки),
+# а каждый запуск задачи идёт в своём loop, поэтому общий redis_client там использовать нельзя
+_task_redis: ContextVar[Optional[InstrumentedRedis]] = ContextVar("task_redis", default=None)
+
+def get_redis() -> InstrumentedRedis:
+    client = _task_redis.get()
+    return redis_client if client is None else client
+
+@asynccontextmanager
+async def task_redis_client() -> AsyncIterator[InstrumentedRedis]:
+    """Отдельный пул на время запуска задачи; внутри блока функции модуля работают через него."""
+    client = InstrumentedRedis(connection_pool=create_redis_pool())
+    token = _task_redis.set(client)
+    try:
+        yield client
+    finally:
+        _task_redis.reset(token)
+        await client.connection_pool.disconnect()
+
+local_cache = LocalCache(
+    maxsize=int(os.getenv("LOCAL_CACHE_SIZE", 10000)),
+    ttl=float(os.getenv("LOCAL_CACHE_TTL", 30))
+)
+
+# Аутентификация: разобранные токены (token -> subject) и пользователи по subject
+token_cache = LocalCache(
+    maxsize=int(os.getenv("TOKEN_CACHE_SIZE", 10000)),
+    ttl=float(os.getenv("TOKEN_CACHE_TTL", 3600))
+)
+principal_cache = LocalCache(
+    maxsize=int(os.getenv("PRINCIPAL_CACHE_SIZE", 10000)),
+    ttl=float(os.getenv("PRINCIPAL_CACHE_TTL", 60))
+)
+
+_LOOKUP_LOCAL_HIT = CACHE_LOOKUPS.labels("get_cached_link", "local_hit")
+_LOOKUP_REDIS_HIT = CACHE_LOOKUPS.labels("get_cached_link", "redis_hit")
+_LOOKUP_MISS = CACHE_LOOKUPS.labels("get_cached_link", "miss")
+_REDIRECT_LOCAL_HIT = CACHE_LOOKUPS.labels("resolve_redirect", "local_hit")
+_REDIRECT_REDIS_HIT = CACHE_LOOKUPS.labels("resolve_redirect", "redis_hit")
+_REDIRECT_NEGATIVE = CACHE_LOOKUPS.labels("resolve_redirect", "negative")
+_REDIRECT_MISS = CACHE_LOOKUPS.labels("resolve_redirect", "miss")
+
+TASK_METRICS_KEY = "metrics:tasks"
+
+INVALIDATION_CHANNEL = "links:invalidate"
+PRINCIPAL_INVALIDATION_CHANNEL = "users:invalidate"
+DIRTY_LINKS_KEY = "links:dirty"
+CLICK_FLUSH_LOCK_KEY = f"{DIRTY_LINKS_KEY}:lock"
+CLICK_FLUSH_LOCK_TTL = int(os.getenv("CLICK_FLUSH_LOCK_TTL", 300))
+# Очередь истечения: ссылка -> срок жизни (unix time), по ней задача expire_due_links удаляет ссылки вовремя
+EXPIRY_QUEUE_KEY = "links:expiry"
+LINK_EXPIRED = 0
+LINK_NOT_FOUND = -1
+
+TOMBSTONE_EXPIRED = "expired"
+TOMBSTONE_DELETED = "deleted"
+TOMBSTONE_MISSING = "missing"
+TOMBSTONE_TTL = int(os.getenv("TOMBSTONE_TTL", 300))
+NEGATIVE_CACHE_TTL = int(os.getenv("NEGATIVE_CACHE_TTL", 60))
+
+link_filter = BloomFilter(
+    capacity=int(os.getenv("BLOOM_CAPACITY", 1000000)),
+    error_rate=float(os.getenv("BLOOM_ERROR_RATE", 0.01))
 )
+# Параметры входят в имя ключа: после их смены фильтр не используется, пока его не перестроят
+LINK_FILTER_KEY = f"links:bloom:{link_filter.size}:{link_filter.hashes}"
+LINK_FILTER_BUILD_KEY = f"{LINK_FILTER_KEY}:build"
+LINK_FILTER_LOCK_KEY = f"{LINK_FILTER_KEY}:lock"
+LINK_FILTER_LOCK_TTL = int(os.getenv("BLOOM_REBUILD_LOCK_TTL", 300))
+# Коды, добавленные до коммита, помнятся BLOOM_RECENT_WINDOW секунд: перестройка могла пройти их id раньше коммита
+LINK_FILTER_RECENT_KEY = f"{LINK_FILTER_KEY}:recent"
+LINK_FILTER_RECENT_WINDOW = int(os.getenv("BLOOM_RECENT_WINDOW", 600))
+
+# Аналитика переходов: каждый переход пишется сразу в минутный, часовой и дневной бакет,
+# устаревшие мелкие бакеты удаляются, поэтому на ссылку хранится не больше
+# ANALYTICS_MINUTES + ANALYTICS_HOURS + ANALYTICS_DAYS счётчиков
+ANALYTICS_MINUTES = int(os.getenv("ANALYTICS_MINUTES", 60))
+ANALYTICS_HOURS = int(os.getenv("ANALYTICS_HOURS", 48))
+ANALYTICS_DAYS = int(os.getenv("ANALYTICS_DAYS", 90))
+# Прогрев кэша: сколько популярных ссылок загружать, пачка на один конвейер,
+# число одновременных конвейеров и ограничение темпа (ссылок в секунду, 0 - без ограничения)
+WARMUP_TOP_N = int(os.getenv("WARMUP_TOP_N", 10000))
+WARMUP_RECENT_DAYS = int(os.getenv("WARMUP_RECENT_DAYS", 7))
+WARMUP_BATCH_SIZE = int(os.getenv("WARMUP_BATCH_SIZE", 500))
+WARMUP_CONCURRENCY = int(os.getenv("WARMUP_CONCURRENCY", 4))
+WARMUP_RATE = float(os.getenv("WARMUP_RATE", 5000))
+
+ANALYTICS_SERIES = (("minutes", 60, ANALYTICS_MINUTES), ("hours", 3600, ANALYTICS_HOURS), ("days", 86400, ANALYTICS_DAYS))
+
+# link:{code}        - hash {url, exp}: неизменяемая часть, пишется только при заполнении кэша
+# link:{code}:clicks - hash {count, last}: переходы, ещё не учтённые в БД, и время последнего
+# link:{code}:gone   - string expired/deleted/missing с коротким TTL: код, которого нет в БД
+# link:{code}:m/h/d  - hash {начало бакета: переходы} по минутам, часам и дням
+# link:{code}:visitors - HyperLogLog отпечатков клиентов
+# links:dirty        - set кодов с неучтёнными переходами, его разбирает flush_click_counters
+# links:bloom:{m}:{k} - битовая карта фильтра Блума всех существующих кодов
+
+# record_click(keys, now, code, fingerprint): keys - link:{code}:clicks, links:dirty,
+# link:{code}:m, link:{code}:h, link:{code}:d, link:{code}:visitors
+RECORD_CLICK_LUA_FUNCTION = f"""
+local STEPS = {{{", ".join(str(step) for _, step, _ in ANALYTICS_SERIES)}}}
+local KEEP = {{{", ".join(str(keep) for _, _, keep in ANALYTICS_SERIES)}}}
+""" + """
+local function record_click(keys, now, code, fingerprint)
+    redis.call('HINCRBY', keys[1], 'count', 1)
+    redis.call('HSET', keys[1], 'last', now)
+    redis.call('SADD', keys[2], code)
+    for i, step in ipairs(STEPS) do
+        local key = keys[2 + i]
+        local bucket = now - now % step
+        if redis.call('HINCRBY', key, bucket, 1) == 1 then
+            -- появился новый бакет: выбрасываем вышедшие из окна
+            local oldest = bucket - step * KEEP[i]
+            for _, field in ipairs(redis.call('HKEYS', key)) do
+                if tonumber(field) <= oldest then
+                    redis.call('HDEL', key, field)
+                end
+            end
+        end
+        redis.call('EXPIRE', key, step * KEEP[i])
+    end
+    if fingerprint ~= '' then
+        redis.call('PFADD', keys[6], fingerprint)
+        redis.call('EXPIRE', keys[6], STEPS[3] * KEEP[3])
+    end
+end
+"""
+
+# ARGV[1] - текущее время (unix timestamp), ARGV[2] - short_code, ARGV[3] - отпечаток клиента
+RECORD_CLICK_LUA = RECORD_CLICK_LUA_FUNCTION + """
+record_click(KEYS, tonumber(ARGV[1]), ARGV[2], ARGV[3])
+return 1
+"""
+
+# KEYS[1] - link:{code}, KEYS[2] - link:{code}:gone, KEYS[3] - фильтр Блума, KEYS[4..9] - как в record_click
+# ARGV[1] - текущее время, ARGV[2] - short_code, ARGV[3] - отпечаток клиента, ARGV[4] - TTL надгробия,
+# ARGV[5..] - номера битов кода в фильтре
+RESOLVE_REDIRECT_LUA = RECORD_CLICK_LUA_FUNCTION + """
+local link = redis.call('HMGET', KEYS[1], 'url', 'exp')
+if not link[1] then
+    local gone = redis.call('GET', KEYS[2])
+    if gone then
+        return gone == 'expired' and 0 or -1
+    end
+    if redis.call('EXISTS', KEYS[3]) == 1 then
+        for i = 5, #ARGV do
+            if redis.call('GETBIT', KEYS[3], ARGV[i]) == 0 then
+                return -1
+            end
+        end
+    end
+    return nil
+end
+local now = tonumber(ARGV[1])
+local exp = tonumber(link[2])
+if exp and exp <= now then
+    redis.call('DEL', KEYS[1])
+    redis.call('SET', KEYS[2], 'expired', 'EX', ARGV[4])
+    return 0
+end
+record_click({KEYS[4], KEYS[5], KEYS[6], KEYS[7], KEYS[8], KEYS[9]}, now, ARGV[2], ARGV[3])
+return {link[1], link[2] or ''}
+"""
+
+# Вычитает сброшенные в БД переходы; если новых не появилось, убирает счётчик и код из links:dirty
+# KEYS[1] - links:dirty, KEYS[2..] - link:{code}:clicks
+# ARGV - пары (short_code, сброшенное количество) в порядке KEYS[2..]
+ACK_CLICKS_LUA = """
+for i = 2, #KEYS do
+    local code = ARGV[2 * i - 3]
+    local left = redis.call('HINCRBY', KEYS[i], 'count', -tonumber(ARGV[2 * i - 2]))
+    if left <= 0 then
+        redis.call('DEL', KEYS[i])
+        redis.call('SREM', KEYS[1], code)
+    end
+end
+return #KEYS - 1
+"""
+
+# Ставит биты в рабочий фильтр и в строящийся, если идёт перестройка
+# KEYS - фильтры, ARGV - номера битов
+ADD_TO_FILTER_LUA = """
+for _, key in ipairs(KEYS) do
+    if redis.call('EXISTS', key) == 1 then
+        for i = 1, #ARGV do
+            redis.call('SETBIT', key, ARGV[i], 1)
+        end
+    end
+end
+return #ARGV
+"""
+
+# Снимает коды с очереди истечения, если их срок не продлили после выборки
+# KEYS[1] - очередь, ARGV[1] - момент выборки, ARGV[2..] - коды
+ACK_EXPIRIES_LUA = """
+local removed = 0
+for i = 2, #ARGV do
+    local score = redis.call('ZSCORE', KEYS[1], ARGV[i])
+    if score and tonumber(score) <= tonumber(ARGV[1]) then
+        removed = removed + redis.call('ZREM', KEYS[1], ARGV[i])
+    end
+end
+return removed
+"""
+
+_resolve_redirect_script = redis_client.register_script(RESOLVE_REDIRECT_LUA)
+_record_click_script = redis_client.register_script(RECORD_CLICK_LUA)
+_ack_clicks_script = redis_client.register_script(ACK_CLICKS_LUA)
+_ack_expiries_script = redis_client.register_script(ACK_EXPIRIES_LUA)
+
+def _to_timestamp(value: datetime) -> int:
+    # Округляем вверх: по кэшу ссылка не должна истечь раньше, чем в БД
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return math.ceil(value.timestamp())
+
+def _from_timestamp(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    return datetime.utcfromtimestamp(int(value))
+
+def _remember(short_code: str, url: str, exp: Optional[str]) -> None:
+    exp = int(exp) if exp else None
+    ttl = exp - time.time() if exp else None
+    local_cache.set(short_code, (url, exp), ttl=ttl)
+
+def _expiry_score(expires_at: datetime) -> int:
+    # Код в очереди становится «должным» не раньше, чем ссылка истечёт в БД
+    return _to_timestamp(expires_at)
+
+def _queue_link(pipe, short_code: str, original_url: str, expires_at: Optional[datetime], expire_seconds: int) -> None:
+    record = {"url": original_url}
+    ttl = expire_seconds
+    if expires_at:
+        record["exp"] = _to_timestamp(expires_at)
+        # Запись живёт не дольше самой ссылки - истёкшие Redis удаляет сам
+        ttl = max(1, min(ttl, _expiry_score(expires_at) - int(time.time())))
+        pipe.zadd(EXPIRY_QUEUE_KEY, {short_code: _expiry_score(expires_at)})
+    pipe.delete(f"link:{short_code}", f"link:{short_code}:gone")
+    pipe.hset(f"link:{short_code}", mapping=record)
+    pipe.expire(f"link:{short_code}", ttl)
+
+def _queue_filter_add(pipe, short_codes: List[str]) -> None:
+    offsets = [offset for short_code in short_codes for offset in link_filter.offsets(short_code)]
+    if offsets:
+        pipe.eval(ADD_TO_FILTER_LUA, 2, LINK_FILTER_KEY, LINK_FILTER_BUILD_KEY, *offsets)
+
+def _click_keys(short_code: str) -> List[str]:
+    return [
+        f"link:{short_code}:clicks", DIRTY_LINKS_KEY,
+        f"link:{short_code}:m", f"link:{short_code}:h", f"link:{short_code}:d",
+        f"link:{short_code}:visitors"
+    ]
 
-def get_cached_link(short_code: str) -> Optional[Dict[str, Any]]:
-    cached_data = redis_client.get(f"link:{short_code}")
-    if cached_data:
-        return json.loads(cached_data)
-    return None
-
-def set_cached_link(short_code: str, link_data: Dict[str, Any], expire_seconds: int = 3600) -> None:
-    redis_client.setex(
-        f"link:{short_code}",
-        expire_seconds,
-        json.dumps(link_data)
+def _analytics_keys(short_code: str) -> List[str]:
+    return _click_keys(short_code)[2:]
+
+async def get_cached_link(short_code: str) -> Optional[Dict[str, Any]]:
+    record = local_cache.get(short_code)
+    if record is None:
+        url, exp = await get_redis().hmget(f"link:{short_code}", "url", "exp")
+        if url is None:
+            _LOOKUP_MISS.inc()
+            return None
+        _LOOKUP_REDIS_HIT.inc()
+        _remember(short_code, url, exp)
+        return {"original_url": url, "expires_at": _from_timestamp(exp)}
+    _LOOKUP_LOCAL_HIT.inc()
+    url, exp = record
+    return {"original_url": url, "expires_at": _from_timestamp(exp)}
+
+async def set_cached_link(
+    short_code: str,
+    original_url: str,
+    expires_at: Optional[datetime] = None,
+    expire_seconds: int = 3600
+) -> None:
+    async with get_redis().pipeline() as pipe:
+        _queue_link(pipe, short_code, original_url, expires_at, expire_seconds)
+        _queue_filter_add(pipe, [short_code])
+        await pipe.execute()
+
+async def add_to_link_filter(short_codes: List[str]) -> None:
+    # Вызывается до коммита новых ссылок: иначе при сбое записи в кэш фильтр отвечал бы "нет" до перестройки
+    if not short_codes:
+        return
+    now = time.time()
+    async with get_redis().pipeline(transaction=False) as pipe:
+        _queue_filter_add(pipe, short_codes)
+        pipe.zadd(LINK_FILTER_RECENT_KEY, {short_code: now for short_code in short_codes})
+        pipe.zremrangebyscore(LINK_FILTER_RECENT_KEY, "-inf", now - LINK_FILTER_RECENT_WINDOW)
+        await pipe.execute()
+
+async def set_cached_links(links: Iterable[Dict[str, Any]], expire_seconds: int = 3600) -> None:
+    short_codes = []
+    async with get_redis().pipeline(transaction=False) as pipe:
+        for link in links:
+            _queue_link(pipe, link["short_code"], link["original_url"], link.get("expires_at"), expire_seconds)
+            short_codes.append(link["short_code"])
+        _queue_filter_add(pipe, short_codes)
+        await pipe.execute()
+
+async def _publish_invalidations(short_codes: List[str]) -> None:
+    for short_code in short_codes:
+        local_cache.invalidate(short_code)
+    async with get_redis().pipeline(transaction=False) as pipe:
+        for short_code in short_codes:
+            pipe.publish(INVALIDATION_CHANNEL, short_code)
+        await pipe.execute()
+
+async def invalidate_cached_link(short_code: str) -> None:
+    await get_redis().delete(f"link:{short_code}")
+    await _publish_invalidations([short_code])
+
+async def replace_cached_link(short_code: str, original_url: str, expires_at: Optional[datetime] = None) -> None:
+    # Пишем строку из основной БД сразу: после удаления запись могла бы заполнить отстающая реплика
+    await set_cached_link(short_code, original_url, expires_at)
+    await _publish_invalidations([short_code])
+
+async def delete_cached_link(short_code: str, tombstone: Optional[str] = TOMBSTONE_DELETED) -> None:
+    await delete_cached_links([short_code], tombstone)
+
+async def delete_cached_links(short_codes: List[str], tombstone: Optional[str] = TOMBSTONE_DELETED) -> None:
+    if not short_codes:
+        return
+    async with get_redis().pipeline(transaction=False) as pipe:
+        for short_code in short_codes:
+            pipe.delete(f"link:{short_code}", f"link:{short_code}:clicks", *_analytics_keys(short_code))
+            if tombstone:
+                pipe.set(f"link:{short_code}:gone", tombstone, ex=TOMBSTONE_TTL)
+        pipe.srem(DIRTY_LINKS_KEY, *short_codes)
+        await pipe.execute()
+    await _publish_invalidations(short_codes)
+
+async def set_tombstones(short_codes: List[str], tombstone: str, ttl: int = TOMBSTONE_TTL) -> None:
+    async with get_redis().pipeline(transaction=False) as pipe:
+        for short_code in short_codes:
+            pipe.set(f"link:{short_code}:gone", tombstone, ex=ttl)
+        await pipe.execute()
+
+async def schedule_link_expiries(links: Iterable[Tuple[str, datetime]]) -> None:
+    scores = {short_code: _expiry_score(expires_at) for short_code, expires_at in links}
+    if scores:
+        await get_redis().zadd(EXPIRY_QUEUE_KEY, scores)
+
+async def get_due_expiries(now: int, limit: int) -> List[str]:
+    return await get_redis().zrangebyscore(EXPIRY_QUEUE_KEY, "-inf", now, start=0, num=limit)
+
+async def ack_expiries(short_codes: List[str], now: int) -> int:
+    return await _ack_expiries_script(keys=[EXPIRY_QUEUE_KEY], args=[now, *short_codes], client=get_redis())
+
+async def resolve_redirect(short_code: str, fingerprint: str = "") -> Optional[Union[str, int]]:
+    """Обрабатывает переход по закэшированной ссылке за один вызов Redis.
+
+    Возвращает original_url при попадании, LINK_EXPIRED если срок действия
+    истёк (запись при этом удаляется), LINK_NOT_FOUND если кода точно нет
+    (надгробие или фильтр Блума), None при промахе - тогда нужен запрос в БД.
+    При попадании в локальный кэш в Redis уходят только счётчики.
+    """
+    now = int(time.time())
+    record = local_cache.get(short_code)
+    if record is not None:
+        url, exp = record
+        if exp is None or exp > now:
+            _REDIRECT_LOCAL_HIT.inc()
+            await record_click(short_code, now, fingerprint)
+            return url
+        local_cache.invalidate(short_code)
+
+    result = await _resolve_redirect_script(
+        keys=[f"link:{short_code}", f"link:{short_code}:gone", LINK_FILTER_KEY, *_click_keys(short_code)],
+        args=[now, short_code, fingerprint, TOMBSTONE_TTL, *link_filter.offsets(short_code)],
+        client=get_redis()
+    )
+    if result is None:
+        _REDIRECT_MISS.inc()
+        return result
+    if isinstance(result, int):
+        _REDIRECT_NEGATIVE.inc()
+        return result
+    _REDIRECT_REDIS_HIT.inc()
+    url, exp = result
+    _remember(short_code, url, exp)
+    return url
+
+async def record_click(short_code: str, now: Optional[int] = None, fingerprint: str = "") -> None:
+    await _record_click_script(
+        keys=_click_keys(short_code),
+        args=[now or int(time.time()), short_code, fingerprint],
+        client=get_redis()
+    )
+
+async def get_click_stats(short_code: str) -> Dict[str, Any]:
+    count, last = await get_redis().hmget(f"link:{short_code}:clicks", "count", "last")
+    return {"access_count": int(count or 0), "last_accessed": _from_timestamp(last)}
+
+async def get_click_analytics(short_code: str) -> Dict[str, Any]:
+    """Ряды переходов по минутам, часам и дням (с нулями для пустых бакетов) и оценка уникальных посетителей."""
+    keys = _analytics_keys(short_code)
+    async with get_redis().pipeline(transaction=False) as pipe:
+        for key in keys[:3]:
+            pipe.hgetall(key)
+        pipe.pfcount(keys[3])
+        *buckets, unique_visitors = await pipe.execute()
+
+    now = int(time.time())
+    analytics: Dict[str, Any] = {"unique_visitors": unique_visitors}
+    for (name, step, keep), counts in zip(ANALYTICS_SERIES, buckets):
+        current = now - now % step
+        analytics[name] = [
+            {"start": datetime.utcfromtimestamp(start), "clicks": int(counts.get(str(start), 0))}
+            for start in range(current - step * (keep - 1), current + 1, step)
+        ]
+    return analytics
+
+async def iter_dirty_links(batch_size: int = 500) -> AsyncIterator[List[str]]:
+    batch = []
+    async for short_code in get_redis().sscan_iter(DIRTY_LINKS_KEY, count=batch_size):
+        batch.append(short_code)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def click_flush_lock(wait: float = 0):
+    """Блокировка сброса счётчиков (SET NX EX с токеном): без неё два сброса прочитают одни и те же переходы."""
+    return get_redis().lock(CLICK_FLUSH_LOCK_KEY, timeout=CLICK_FLUSH_LOCK_TTL, blocking_timeout=wait)
+
+async def get_pending_clicks(short_codes: List[str]) -> List[Dict[str, Any]]:
+    async with get_redis().pipeline(transaction=False) as pipe:
+        for short_code in short_codes:
+            pipe.hmget(f"link:{short_code}:clicks", "count", "last")
+        results = await pipe.execute()
+    pending = []
+    for short_code, (count, last) in zip(short_codes, results):
+        pending.append({
+            "short_code": short_code,
+            "access_count": int(count or 0),
+            "last_accessed": _from_timestamp(last)
+        })
+    return pending
+
+async def ack_flushed_clicks(flushed: List[Dict[str, Any]]) -> None:
+    if not flushed:
+        return
+    args = []
+    for item in flushed:
+        args.extend([item["short_code"], item["access_count"]])
+    await _ack_clicks_script(
+        keys=[DIRTY_LINKS_KEY] + [f"link:{item['short_code']}:clicks" for item in flushed],
+        args=args,
+        client=get_redis()
+    )
+
+async def link_filter_ready() -> bool:
+    return bool(await get_redis().exists(LINK_FILTER_KEY))
+
+def link_filter_lock():
+    """Блокировка перестройки фильтра: две одновременные перестройки портили бы общий строящийся ключ."""
+    return get_redis().lock(LINK_FILTER_LOCK_KEY, timeout=LINK_FILTER_LOCK_TTL, blocking_timeout=0)
+
+async def rebuild_link_filter(short_code_batches: AsyncIterator[List[str]]) -> int:
+    """Строит фильтр Блума заново из переданных пачек кодов и атомарно подменяет рабочий.
+
+    Пока идёт перестройка, новые коды пишутся в оба фильтра, поэтому созданные
+    во время обхода таблицы ссылки не потеряются. Коды, добавленные незадолго до начала
+    и закоммиченные уже после того, как обход прошёл их id, дописываются перед подменой.
+    """
+    async with get_redis().pipeline(transaction=False) as pipe:
+        pipe.delete(LINK_FILTER_BUILD_KEY)
+        pipe.setbit(LINK_FILTER_BUILD_KEY, link_filter.size - 1, 0)
+        await pipe.execute()
+    total = 0
+    async for short_codes in short_code_batches:
+        async with get_redis().pipeline(transaction=False) as pipe:
+            for short_code in short_codes:
+                for offset in link_filter.offsets(short_code):
+                    pipe.setbit(LINK_FILTER_BUILD_KEY, offset, 1)
+            await pipe.execute()
+        total += len(short_codes)
+    recent = await get_redis().zrangebyscore(
+        LINK_FILTER_RECENT_KEY, time.time() - LINK_FILTER_RECENT_WINDOW, "+inf"
     )
+    async with get_redis().pipeline(transaction=False) as pipe:
+        for short_code in recent:
+            for offset in link_filter.offsets(short_code):
+                pipe.setbit(LINK_FILTER_BUILD_KEY, offset, 1)
+        pipe.rename(LINK_FILTER_BUILD_KEY, LINK_FILTER_KEY)
+        await pipe.execute()
+    return total
+
+async def warm_link_cache(
+    links: List[Dict[str, Any]],
+    batch_size: int = WARMUP_BATCH_SIZE,
+    concurrency: int = WARMUP_CONCURRENCY,
+    rate: float = WARMUP_RATE,
+    local: bool = False,
+    on_progress: Optional[Callable[[int, int], None]] = None
+) -> Dict[str, Any]:
+    """Загружает ссылки в Redis пачками по batch_size (один конвейер на пачку), при local - и в локальный кэш.
+
+    Одновременно выполняется не больше concurrency конвейеров, а темп ограничен rate ссылками
+    в секунду, чтобы прогрев не отнимал Redis и event loop у живого трафика.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    started = time.monotonic()
+    warmed = 0
+
+    async def write(batch: List[Dict[str, Any]]) -> None:
+        nonlocal warmed
+        try:
+            await set_cached_links(batch)
+        finally:
+            semaphore.release()
+        if local:
+            for link in batch:
+                expires_at = link.get("expires_at")
+                _remember(link["short_code"], link["original_url"], _to_timestamp(expires_at) if expires_at else None)
+        warmed += len(batch)
+        if on_progress is not None:
+            on_progress(warmed, len(links))
+
+    writes = []
+    for start in range(0, len(links), batch_size):
+        if rate > 0:
+            delay = started + start / rate - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        await semaphore.acquire()
+        writes.append(asyncio.create_task(write(links[start:start + batch_size])))
+    await asyncio.gather(*writes)
+
+    elapsed = time.monotonic() - started
+    return {
+        "warmed": warmed,
+        "batches": len(writes),
+        "seconds": round(elapsed, 3),
+        "links_per_second": round(warmed / elapsed, 1) if elapsed > 0 else 0.0
+    }
+
+async def invalidate_principal(username: str) -> None:
+    principal_cache.invalidate(username)
+    await get_redis().publish(PRINCIPAL_INVALIDATION_CHANNEL, username)
+
+async def record_task_run(task: str, seconds: float, deleted: Optional[int] = None) -> None:
+    # Задачи Celery идут в других процессах, поэтому их метрики копятся в Redis
+    key = f"{TASK_METRICS_KEY}:{task}"
+    async with get_redis().pipeline(transaction=False) as pipe:
+        pipe.sadd(TASK_METRICS_KEY, task)
+        pipe.hincrby(key, "runs", 1)
+        pipe.hincrbyfloat(key, "seconds", seconds)
+        pipe.hset(key, "last_seconds", seconds)
+        if deleted is not None:
+            pipe.hincrby(key, "deleted", deleted)
+        await pipe.execute()
+
+async def get_task_stats() -> Dict[str, Dict[str, float]]:
+    tasks = sorted(await get_redis().smembers(TASK_METRICS_KEY))
+    async with get_redis().pipeline(transaction=False) as pipe:
+        for task in tasks:
+            pipe.hgetall(f"{TASK_METRICS_KEY}:{task}")
+        results = await pipe.execute()
+    return {
+        task: {field: float(value) for field, value in stats.items()}
+        for task, stats in zip(tasks, results)
+    }
+
+async def close_redis() -> None:
+    await redis_client.connection_pool.disconnect()
 
-def delete_cached_link(short_code: str) -> None:
-    redis_client.delete(f"link:{short_code}")
+async def _listen_for_invalidations() -> None:
+    while True:
+        try:
+            async with redis_client.pubsub(ignore_subscribe_messages=True) as pubsub:
+                await pubsub.subscribe(INVALIDATION_CHANNEL, PRINCIPAL_INVALIDATION_CHANNEL)
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    if message["channel"] == PRINCIPAL_INVALIDATION_CHANNEL:
+                        principal_cache.invalidate(message["data"])
+                    else:
+                        local_cache.invalidate(message["data"])
+        except RedisError as e:
+            logger.warning(f"Local cache invalidation listener disconnected: {e}")
+            local_cache.clear()
+            principal_cache.clear()
+            await asyncio.sleep(1.0)
 
-def increment_access_count(short_code: str) -> int:
-    return redis_client.incr(f"link:{short_code}:access_count")
+_invalidation_listener: Optional[asyncio.Task] = None
 
-def get_link_stats(short_code: str) -> Optional[Dict[str, Any]]:
-    cached_data = redis_client.get(f"link:{short_code}:stats")
-    if cached_data:
-        return json.loads(cached_data)
-    return None
+def start_invalidation_listener() -> None:
+    global _invalidation_listener
+    _invalidation_listener = asyncio.get_running_loop().create_task(_listen_for_invalidations())
 
-def set_link_stats(short_code: str, stats_data: Dict[str, Any], expire_seconds: int = 3600) -> None:
-    redis_client.setex(
-        f"link:{short_code}:stats",
-        expire_seconds,
-        json.dumps(stats_data)
-    ) 
\ No newline at end of file
+async def stop_invalidation_listener() -> None:
+    global _invalidation_listener
+    if _invalidation_listener is not None:
+        _invalidation_listener.cancel()
+        try:
+            await _invalidation_listener
+        except asyncio.CancelledError:
+            pass
+        _invalidation_listener = None
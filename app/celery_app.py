@@ -15,9 +15,28 @@ celery_app = Celery(
 )
 
 celery_app.conf.beat_schedule = {
-    'cleanup-expired-links-every-hour': {
+    'flush-click-counters': {
+        'task': 'app.tasks.flush_click_counters',
+        'schedule': timedelta(seconds=int(os.getenv("CLICK_FLUSH_INTERVAL", 30))),
+    },
+    'rebuild-short-code-filter': {
+        'task': 'app.tasks.rebuild_short_code_filter',
+        'schedule': timedelta(seconds=int(os.getenv("BLOOM_REBUILD_INTERVAL", 6 * 3600))),
+    },
+    # Построенный фильтр не трогает, холодный (после потери данных Redis) строит сразу
+    'build-cold-short-code-filter': {
+        'task': 'app.tasks.rebuild_short_code_filter',
+        'schedule': timedelta(seconds=int(os.getenv("BLOOM_COLD_CHECK_INTERVAL", 60))),
+        'kwargs': {'only_if_cold': True},
+    },
+    'expire-due-links': {
+        'task': 'app.tasks.expire_due_links',
+        'schedule': timedelta(seconds=int(os.getenv("EXPIRY_QUEUE_INTERVAL", 10))),
+    },
+    # Полный проход - страховка: обычно ссылки удаляет expire_due_links по очереди истечения
+    'cleanup-expired-links-daily': {
         'task': 'app.tasks.cleanup_expired_links',
-        'schedule': crontab(minute=0, hour='*'),
+        'schedule': crontab(minute=30, hour=0),
     },
     'cleanup-inactive-links-every-day': {
         'task': 'app.tasks.cleanup_inactive_links',
@@ -1,10 +1,10 @@
+from sqlalchemy import bindparam, case, or_, select, update
 from sqlalchemy.orm import Session
 from . import models, schemas
 from .auth import get_password_hash
+from .urls import url_digest
 from datetime import datetime, timedelta
-import random
-import string
-from typing import Optional, List
+from typing import List
 
 def get_user(db: Session, user_id: int):
     return db.query(models.User).filter(models.User.id == user_id).first()
@@ -36,24 +36,11 @@ def get_link_by_id(db: Session, link_id: int):
 def get_links(db: Session, skip: int = 0, limit: int = 100):
     return db.query(models.Link).offset(skip).limit(limit).all()
 
-def create_link(db: Session, link: schemas.LinkCreate, user_id: Optional[int] = None):
-    short_code = generate_short_code()
-    db_link = models.Link(
-        original_url=str(link.original_url),
-        short_code=short_code,
-        custom_alias=link.custom_alias,
-        expires_at=link.expires_at,
-        owner_id=user_id
-    )
-    db.add(db_link)
-    db.commit()
-    db.refresh(db_link)
-    return db_link
-
 def update_link(db: Session, link_id: int, link: schemas.LinkCreate):
     db_link = get_link_by_id(db, link_id)
     if db_link:
         db_link.original_url = str(link.original_url)
+        db_link.url_hash = url_digest(db_link.original_url)
         if link.custom_alias:
             db_link.custom_alias = link.custom_alias
         if link.expires_at:
@@ -79,13 +66,42 @@ def increment_click_count(db: Session, short_code: str):
         db.refresh(db_link)
     return db_link
 
+def apply_click_counts(db: Session, counts: List[dict]):
+    links = models.Link.__table__
+    stmt = (
+        update(links)
+        .where(links.c.short_code == bindparam("code"))
+        .values(
+            access_count=links.c.access_count + bindparam("delta"),
+            last_accessed=case(
+                (or_(links.c.last_accessed.is_(None), links.c.last_accessed < bindparam("last")), bindparam("last")),
+                else_=links.c.last_accessed
+            )
+        )
+    )
+    db.execute(stmt, [
+        {"code": item["short_code"], "delta": item["access_count"], "last": item["last_accessed"]}
+        for item in counts
+    ])
+    db.commit()
+
+def popular_links_query(limit: int, recent_days: int = 0):
+    """Неистёкшие ссылки по убыванию числа переходов; при recent_days > 0 - только с переходами за эти дни."""
+    links = models.Link.__table__
+    now = datetime.utcnow()
+    query = (
+        select(links.c.short_code, links.c.original_url, links.c.expires_at)
+        .where(or_(links.c.expires_at.is_(None), links.c.expires_at > now))
+        .order_by(links.c.access_count.desc(), links.c.id.desc())
+        .limit(limit)
+    )
+    if recent_days > 0:
+        query = query.where(links.c.last_accessed >= now - timedelta(days=recent_days))
+    return query
+
 def search_links(db: Session, original_url: str):
     return db.query(models.Link).filter(models.Link.original_url.like(f"%{original_url}%")).all()
 
-def generate_short_code(length: int = 6):
-    characters = string.ascii_letters + string.digits
-    return ''.join(random.choice(characters) for _ in range(length))
-
 def get_setting(db: Session, key: str):
     return db.query(models.Settings).filter(models.Settings.key == key).first()
 
@@ -113,6 +129,6 @@ def get_expired_links(db: Session) -> List[models.Link]:
 def get_unused_links(db: Session, days: int) -> List[models.Link]:
     cutoff_date = datetime.utcnow() - timedelta(days=days)
     return db.query(models.Link).filter(
-        models.Link.last_used_at < cutoff_date,
-        models.Link.last_used_at.isnot(None)
+        models.Link.last_accessed < cutoff_date,
+        models.Link.last_accessed.isnot(None)
     ).all() 
\ No newline at end of file
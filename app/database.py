@@ -1,18 +1,77 @@
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from itertools import cycle
 import os
 from dotenv import load_dotenv
 
+from app.metrics import instrument_engine
+
 load_dotenv()
 
 SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./url_shortener.db")
 
-connect_args = {"check_same_thread": False} if SQLALCHEMY_DATABASE_URL.startswith("sqlite") else {}
+def to_async_url(url: str) -> str:
+    if url.startswith("sqlite:"):
+        return url.replace("sqlite:", "sqlite+aiosqlite:", 1)
+    if url.startswith("postgresql+psycopg2:"):
+        return url.replace("postgresql+psycopg2:", "postgresql+asyncpg:", 1)
+    if url.startswith("postgresql:"):
+        return url.replace("postgresql:", "postgresql+asyncpg:", 1)
+    return url
+
+ASYNC_SQLALCHEMY_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", to_async_url(SQLALCHEMY_DATABASE_URL))
+
+# Реплики только для чтения (через запятую); без них чтение идёт в основную БД
+READ_DATABASE_URLS = [url.strip() for url in os.getenv("READ_DATABASE_URLS", "").split(",") if url.strip()]
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args=connect_args)
+def engine_options(url: str) -> dict:
+    # У SQLite свои пулы (in-memory - один коннект на поток), настройки пула к ним не применяются
+    if url.startswith("sqlite"):
+        return {"connect_args": {"check_same_thread": False}}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING
+    }
+
+engine = create_engine(SQLALCHEMY_DATABASE_URL, **engine_options(SQLALCHEMY_DATABASE_URL))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, **engine_options(ASYNC_SQLALCHEMY_DATABASE_URL))
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+instrument_engine("sync", engine)
+instrument_engine("async", async_engine.sync_engine)
+
+read_async_engines = []
+for index, url in enumerate(READ_DATABASE_URLS):
+    read_url = to_async_url(url)
+    read_engine = create_async_engine(read_url, **engine_options(read_url))
+    instrument_engine(f"async_read_{index}", read_engine.sync_engine)
+    read_async_engines.append(read_engine)
+
+_read_sessionmakers = cycle([
+    async_sessionmaker(read_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+    for read_engine in read_async_engines
+] or [AsyncSessionLocal])
+
+def AsyncReadSessionLocal() -> AsyncSession:
+    """Сессия для чтения на следующей реплике по кругу (без реплик - на основной БД).
+
+    Реплики отстают, поэтому запись и чтение только что записанного идут через AsyncSessionLocal.
+    """
+    return next(_read_sessionmakers)()
+
 Base = declarative_base()
 
 def get_db():
@@ -20,4 +79,12 @@ def get_db():
     try:
         yield db
     finally:
-        db.close() 
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def get_async_read_db():
+    async with AsyncReadSessionLocal() as db:
+        yield db
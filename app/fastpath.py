@@ -0,0 +1,105 @@
+import hashlib
+import time
+from urllib.parse import quote
+
+from redis.exceptions import RedisError
+
+from app import cache
+from app.metrics import HTTP_REQUEST_DURATION, HTTP_REQUESTS
+
+REDIRECT_STATUS = 307
+# Помечает запрос, для которого fast path уже сходил в кэш и промахнулся
+CACHE_MISS_SCOPE_KEY = "redirect.cache_miss"
+
+# Как в starlette.responses.RedirectResponse
+_LOCATION_SAFE = ":/%#?=@[]!$&'()*+,;~"
+
+def _not_found(detail: str) -> tuple:
+    body = ('{"detail":"%s"}' % detail).encode()
+    start = {
+        "type": "http.response.start",
+        "status": 404,
+        "headers": [(b"content-length", str(len(body)).encode()), (b"content-type", b"application/json")]
+    }
+    return start, {"type": "http.response.body", "body": body}
+
+_EXPIRED = _not_found("Link has expired")
+_NOT_FOUND = _not_found("Link not found")
+_EMPTY_BODY = {"type": "http.response.body", "body": b""}
+
+_METHODS = ("GET", "HEAD")
+_DURATION = {method: HTTP_REQUEST_DURATION.labels(method, "/{short_code}") for method in _METHODS}
+_REDIRECTED = {method: HTTP_REQUESTS.labels(method, "/{short_code}", str(REDIRECT_STATUS)) for method in _METHODS}
+_MISSING = {method: HTTP_REQUESTS.labels(method, "/{short_code}", "404") for method in _METHODS}
+
+def client_fingerprint(host: str, user_agent: str) -> str:
+    # Для уникальных посетителей храним только хеш адреса и User-Agent
+    return hashlib.blake2b(f"{host}|{user_agent}".encode(), digest_size=8).hexdigest()
+
+class RedirectFastPath:
+    """Отвечает на GET/HEAD /{short_code} прямо из кэша, минуя middleware, зависимости и сессию БД.
+
+    В приложение запрос уходит только при промахе кэша (тогда redirect_to_url не ходит
+    в кэш повторно), при ошибке Redis, для путей других маршрутов и для запросов с Origin,
+    чтобы ответ прошёл через CORSMiddleware.
+    """
+
+    def __init__(self, app, router):
+        self.app = app
+        self.router = router
+        self._reserved = None
+
+    def _reserved_paths(self) -> frozenset:
+        if self._reserved is None:
+            self._reserved = frozenset(
+                route.path for route in self.router.routes if "{" not in getattr(route, "path", "{")
+            )
+        return self._reserved
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in _METHODS:
+            await self.app(scope, receive, send)
+            return
+        path = scope["path"]
+        if len(path) < 2 or path.find("/", 1) != -1 or path in self._reserved_paths():
+            await self.app(scope, receive, send)
+            return
+
+        user_agent = b""
+        for name, value in scope["headers"]:
+            if name == b"user-agent":
+                user_agent = value
+            elif name == b"origin":
+                await self.app(scope, receive, send)
+                return
+
+        started = time.perf_counter()
+        method = scope["method"]
+        client = scope.get("client")
+        fingerprint = client_fingerprint(client[0] if client else "", user_agent.decode("latin-1"))
+        try:
+            result = await cache.resolve_redirect(path[1:], fingerprint)
+        except RedisError:
+            # Redis недоступен: приложение не будет пробовать его повторно и возьмёт ссылку из БД
+            result = None
+
+        if result is None:
+            scope[CACHE_MISS_SCOPE_KEY] = True
+            await self.app(scope, receive, send)
+            return
+
+        if isinstance(result, str):
+            location = quote(result, safe=_LOCATION_SAFE).encode("latin-1")
+            await send({
+                "type": "http.response.start",
+                "status": REDIRECT_STATUS,
+                "headers": [(b"location", location), (b"content-length", b"0")]
+            })
+            await send(_EMPTY_BODY)
+            _REDIRECTED[method].inc()
+        else:
+            start, body = _EXPIRED if result == cache.LINK_EXPIRED else _NOT_FOUND
+            await send(start)
+            await send(body if method == "GET" else _EMPTY_BODY)
+            _MISSING[method].inc()
+        _DURATION[method].observe(time.perf_counter() - started)
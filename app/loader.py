@@ -0,0 +1,149 @@
+import asyncio
+import logging
+import os
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Set, Union
+
+from redis.exceptions import RedisError
+from sqlalchemy import bindparam, delete, select
+
+import app.models as models
+from app.cache import (
+    set_cached_links, set_tombstones,
+    LINK_EXPIRED, LINK_NOT_FOUND, TOMBSTONE_EXPIRED, TOMBSTONE_MISSING, NEGATIVE_CACHE_TTL
+)
+from app.metrics import LINK_LOADER_BATCH_SIZE, LINK_LOADER_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+LINK_LOAD_WINDOW_MS = float(os.getenv("LINK_LOAD_WINDOW_MS", 0))
+LINK_LOAD_MAX_BATCH = int(os.getenv("LINK_LOAD_MAX_BATCH", 100))
+
+_links = models.Link.__table__
+# Собраны один раз: IN (...) с expanding-параметром кэшируется SQLAlchemy для любого числа кодов
+LOAD_LINKS_QUERY = select(_links.c.id, _links.c.short_code, _links.c.original_url, _links.c.expires_at).where(
+    _links.c.short_code.in_(bindparam("short_codes", expanding=True))
+)
+DELETE_LINKS_QUERY = delete(_links).where(_links.c.id.in_(bindparam("ids", expanding=True)))
+
+_COALESCED = LINK_LOADER_REQUESTS.labels("coalesced")
+_QUEUED = LINK_LOADER_REQUESTS.labels("queued")
+
+class LinkLoader:
+    """Загрузка ссылок из БД при промахе кэша, в духе DataLoader.
+
+    Одновременные промахи по одному коду ждут одну загрузку, а промахи по разным кодам
+    за window секунд (при 0 - за одну итерацию event loop), но не больше max_batch,
+    складываются в один запрос WHERE short_code IN (...). Результат пачки сразу пишется в кэш одним конвейером,
+    истёкшие ссылки удаляются одной транзакцией, для отсутствующих ставится надгробие.
+
+    Читает через session_factory (реплика), а удаляет истёкшие через write_session_factory.
+    Не найденные на реплике коды перепроверяются в основной БД: ссылка могла ещё не доехать.
+
+    load возвращает то же, что resolve_redirect: URL, LINK_EXPIRED или LINK_NOT_FOUND.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable,
+        write_session_factory: Callable,
+        window: float = LINK_LOAD_WINDOW_MS / 1000,
+        max_batch: int = LINK_LOAD_MAX_BATCH
+    ):
+        self.session_factory = session_factory
+        self.write_session_factory = write_session_factory
+        self.window = window
+        self.max_batch = max_batch
+        # Код -> результат загрузки, от постановки в очередь до конца загрузки
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._pending: List[str] = []
+        self._timer: Optional[asyncio.Handle] = None
+        self._dispatches: Set[asyncio.Task] = set()
+
+    async def load(self, short_code: str) -> Union[str, int]:
+        future = self._inflight.get(short_code)
+        if future is not None:
+            _COALESCED.inc()
+        else:
+            _QUEUED.inc()
+            loop = asyncio.get_running_loop()
+            future = self._inflight[short_code] = loop.create_future()
+            self._pending.append(short_code)
+            if len(self._pending) >= self.max_batch:
+                self._flush()
+            elif self._timer is None:
+                # Без окна пачка собирается из промахов той же итерации event loop
+                if self.window > 0:
+                    self._timer = loop.call_later(self.window, self._flush)
+                else:
+                    self._timer = loop.call_soon(self._flush)
+        # shield: отмена одного ожидающего запроса не должна отменять загрузку для остальных
+        return await asyncio.shield(future)
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        short_codes, self._pending = self._pending, []
+        if not short_codes:
+            return
+        task = asyncio.get_running_loop().create_task(self._dispatch(short_codes))
+        self._dispatches.add(task)
+        task.add_done_callback(self._dispatches.discard)
+
+    async def _dispatch(self, short_codes: List[str]) -> None:
+        LINK_LOADER_BATCH_SIZE.observe(len(short_codes))
+        try:
+            results = await self._load(short_codes)
+        except Exception as e:
+            for short_code in short_codes:
+                future = self._inflight.pop(short_code)
+                if not future.done():
+                    future.set_exception(e)
+            return
+        except asyncio.CancelledError:
+            for short_code in short_codes:
+                self._inflight.pop(short_code).cancel()
+            raise
+        for short_code in short_codes:
+            future = self._inflight.pop(short_code)
+            if not future.done():
+                future.set_result(results[short_code])
+
+    async def _load(self, short_codes: List[str]) -> Dict[str, Union[str, int]]:
+        now = datetime.utcnow()
+        async with self.session_factory() as db:
+            rows = (await db.execute(LOAD_LINKS_QUERY, {"short_codes": short_codes})).all()
+        if len(rows) < len(short_codes) and self.session_factory is not self.write_session_factory:
+            found = {row.short_code for row in rows}
+            missing = [short_code for short_code in short_codes if short_code not in found]
+            async with self.write_session_factory() as db:
+                rows += (await db.execute(LOAD_LINKS_QUERY, {"short_codes": missing})).all()
+        expired = [row for row in rows if row.expires_at and now > row.expires_at]
+        if expired:
+            async with self.write_session_factory() as db:
+                await db.execute(DELETE_LINKS_QUERY, {"ids": [row.id for row in expired]})
+                await db.commit()
+
+        results: Dict[str, Union[str, int]] = {short_code: LINK_NOT_FOUND for short_code in short_codes}
+        live = []
+        for row in rows:
+            if row.expires_at and now > row.expires_at:
+                results[row.short_code] = LINK_EXPIRED
+            else:
+                results[row.short_code] = row.original_url
+                live.append({"short_code": row.short_code, "original_url": row.original_url, "expires_at": row.expires_at})
+
+        missing = [short_code for short_code, result in results.items() if result == LINK_NOT_FOUND]
+        # Запись в кэш - лишь оптимизация: без Redis ссылки всё равно отдаются из БД
+        try:
+            if live:
+                await set_cached_links(live)
+            if expired:
+                await set_tombstones([row.short_code for row in expired], TOMBSTONE_EXPIRED)
+            if missing:
+                # Ложное срабатывание фильтра или фильтр ещё не построен - запоминаем промах ненадолго
+                await set_tombstones(missing, TOMBSTONE_MISSING, NEGATIVE_CACHE_TTL)
+        except RedisError as e:
+            logger.warning(f"Could not cache loaded links: {e}")
+        return results
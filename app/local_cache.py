@@ -0,0 +1,115 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+_SEEDS = (0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9, 0xD6E8FEB86659FD93)
+_MASK64 = 0xFFFFFFFFFFFFFFFF
+
+class FrequencySketch:
+    """Count-min sketch с 4-битными счётчиками и периодическим старением (TinyLFU)."""
+
+    def __init__(self, capacity: int):
+        width = 1
+        while width < max(capacity, 16):
+            width <<= 1
+        self._mask = width - 1
+        self._rows = [bytearray(width) for _ in _SEEDS]
+        self._sample_size = 10 * width
+        self._additions = 0
+
+    def _indexes(self, key: Hashable):
+        h = hash(key)
+        for seed in _SEEDS:
+            yield ((h * seed) & _MASK64) >> 40 & self._mask
+
+    def increment(self, key: Hashable) -> None:
+        for row, index in zip(self._rows, self._indexes(key)):
+            if row[index] < 15:
+                row[index] += 1
+        self._additions += 1
+        if self._additions >= self._sample_size:
+            self._reset()
+
+    def estimate(self, key: Hashable) -> int:
+        return min(row[index] for row, index in zip(self._rows, self._indexes(key)))
+
+    def _reset(self) -> None:
+        for row in self._rows:
+            for index in range(len(row)):
+                row[index] >>= 1
+        self._additions //= 2
+
+class LocalCache:
+    """Ограниченный LRU-кэш процесса с TTL и частотным допуском (TinyLFU).
+
+    Новый ключ вытесняет самый давний только если обращались к нему чаще,
+    поэтому разовые запросы не выталкивают популярные ссылки.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 30.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._sketch = FrequencySketch(maxsize)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rejections = 0
+        self.invalidations = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            self._sketch.increment(key)
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, deadline = entry
+            if deadline <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        with self._lock:
+            deadline = time.monotonic() + ttl
+            if key in self._data:
+                self._data[key] = (value, deadline)
+                self._data.move_to_end(key)
+                return
+            if len(self._data) >= self.maxsize:
+                victim = next(iter(self._data))
+                if self._sketch.estimate(key) <= self._sketch.estimate(victim):
+                    self.rejections += 1
+                    return
+                del self._data[victim]
+                self.evictions += 1
+            self._data[key] = (value, deadline)
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            if self._data.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "rejections": self.rejections,
+            "invalidations": self.invalidations
+        }
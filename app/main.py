@@ -1,29 +1,43 @@
-from fastapi import FastAPI, HTTPException, Depends, Query, Request, status
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import RedirectResponse, JSONResponse
-from sqlalchemy.orm import Session
+from fastapi.responses import RedirectResponse, StreamingResponse
+from sqlalchemy import bindparam, insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from redis.exceptions import RedisError
 from datetime import datetime, timedelta
 from typing import Optional, List
-import random
-import string
 import logging
 from fastapi.security import OAuth2PasswordRequestForm
-import uvicorn
+import asyncio
 import json
+import os
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-from app.database import SessionLocal, engine, get_db
+from app.database import (
+    AsyncSessionLocal, AsyncReadSessionLocal, engine, get_async_db, get_async_read_db
+)
+from app.crud import popular_links_query
 import app.models as models
 import app.schemas as schemas
-from app.redis_client import (
-    get_cached_link, set_cached_link, delete_cached_link,
-    increment_access_count, get_link_stats, set_link_stats
+from app.cache import (
+    set_cached_link, set_cached_links, add_to_link_filter, delete_cached_link, replace_cached_link,
+    resolve_redirect, record_click, get_click_stats, get_click_analytics, LINK_EXPIRED, LINK_NOT_FOUND,
+    warm_link_cache, WARMUP_TOP_N, WARMUP_RECENT_DAYS,
+    local_cache, start_invalidation_listener, stop_invalidation_listener, close_redis, get_task_stats
 )
+from app.loader import LinkLoader
+from app.fastpath import CACHE_MISS_SCOPE_KEY, RedirectFastPath, client_fingerprint
+from app.metrics import MetricsMiddleware, TimedJSONResponse, render, render_task_metrics
+from app.profiling import PROFILING_ENABLED, ProfilingMiddleware, slowest_requests
+from app.shortcode import allocator
+from app.urls import normalize_url, url_digest
 from app.auth import (
     get_current_active_user,
-    get_password_hash,
+    get_current_admin_user,
+    hash_password,
     authenticate_user,
     create_access_token,
     ACCESS_TOKEN_EXPIRE_MINUTES
@@ -31,7 +45,14 @@ from app.auth import (
 
 models.Base.metadata.create_all(bind=engine)
 
-app = FastAPI()
+BATCH_SHORTEN_MAX = int(os.getenv("BATCH_SHORTEN_MAX", 10000))
+BATCH_INSERT_CHUNK = int(os.getenv("BATCH_INSERT_CHUNK", 500))
+LINK_PAGE_SIZE = int(os.getenv("LINK_PAGE_SIZE", 100))
+LINK_PAGE_SIZE_MAX = int(os.getenv("LINK_PAGE_SIZE_MAX", 1000))
+LINK_EXPORT_BATCH = int(os.getenv("LINK_EXPORT_BATCH", 1000))
+CACHE_WARMUP_ON_STARTUP = os.getenv("CACHE_WARMUP_ON_STARTUP", "1") == "1"
+
+app = FastAPI(default_response_class=TimedJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -39,36 +60,75 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Курсор следующей страницы /links должен быть виден браузерным клиентам с других доменов
+    expose_headers=["X-Next-Cursor"],
 )
+# Последний добавленный middleware - внешний: профилирование должно стоять внутри метрик
+if PROFILING_ENABLED:
+    app.add_middleware(ProfilingMiddleware)
+app.add_middleware(MetricsMiddleware)
+# Переходы по коду из кэша обслуживаются до всего остального стека
+app.add_middleware(RedirectFastPath, router=app.router)
+
+@app.on_event("startup")
+async def start_cache_listener():
+    start_invalidation_listener()
+
+async def warm_up_cache() -> None:
+    # Популярные ссылки - в Redis и локальный кэш воркера, чтобы первая волна трафика не ушла в БД
+    try:
+        async with AsyncReadSessionLocal() as db:
+            result = await db.execute(popular_links_query(WARMUP_TOP_N, WARMUP_RECENT_DAYS))
+            links = [dict(row._mapping) for row in result]
+        report = await warm_link_cache(
+            links, local=True, on_progress=lambda warmed, total: logger.info(f"Cache warm-up: {warmed}/{total} links")
+        )
+        logger.info(f"Cache warm-up finished: {report}")
+    except Exception as e:
+        logger.warning(f"Cache warm-up failed: {e}")
 
-def generate_short_code(length: int = 6) -> str:
-    characters = string.ascii_letters + string.digits
-    return ''.join(random.choice(characters) for _ in range(length))
+link_loader = LinkLoader(AsyncReadSessionLocal, AsyncSessionLocal)
+
+_warmup_task: Optional[asyncio.Task] = None
+
+@app.on_event("startup")
+async def start_cache_warmup():
+    global _warmup_task
+    # Прогрев идёт в фоне: приложение принимает запросы, не дожидаясь его
+    if CACHE_WARMUP_ON_STARTUP:
+        _warmup_task = asyncio.get_running_loop().create_task(warm_up_cache())
+
+@app.on_event("shutdown")
+async def stop_cache_listener():
+    if _warmup_task is not None and not _warmup_task.done():
+        _warmup_task.cancel()
+    await stop_invalidation_listener()
+    await close_redis()
 
 @app.post("/register", response_model=schemas.User)
-def register_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    db_user = db.query(models.User).filter(models.User.username == user.username).first()
+async def register_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)):
+    db_user = await db.scalar(select(models.User).where(models.User.username == user.username))
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
 
-    db_user = db.query(models.User).filter(models.User.email == user.email).first()
+    db_user = await db.scalar(select(models.User).where(models.User.email == user.email))
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
 
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await hash_password(user.password)
     db_user = models.User(
         username=user.username,
         email=user.email,
         hashed_password=hashed_password
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
 @app.post("/token", response_model=schemas.Token)
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = authenticate_user(db, form_data.username, form_data.password)
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -97,23 +157,85 @@ async def read_users_me(current_user: models.User = Depends(get_current_active_u
         logger.error(traceback.format_exc())
         raise HTTPException(status_code=500, detail=str(e))
 
+def _link_result(db_link) -> dict:
+    return {
+        "original_url": db_link.original_url,
+        "short_code": db_link.short_code,
+        "custom_alias": db_link.custom_alias,
+        "created_at": db_link.created_at,
+        "expires_at": db_link.expires_at,
+        "last_accessed": db_link.last_accessed,
+        "access_count": db_link.access_count,
+        "owner_id": db_link.owner_id
+    }
+
+# Запросы чтения собраны один раз и выбирают только нужные колонки: строки Row вместо
+# ORM-объектов, без identity map, а скомпилированный SQL берётся из кэша SQLAlchemy
+LINK_RESULT_COLUMNS = (
+    models.Link.original_url,
+    models.Link.short_code,
+    models.Link.custom_alias,
+    models.Link.created_at,
+    models.Link.expires_at,
+    models.Link.last_accessed,
+    models.Link.access_count,
+    models.Link.owner_id
+)
+
+def _links_by_url_query(by_owner: bool, active_only: bool):
+    stmt = select(*LINK_RESULT_COLUMNS).where(models.Link.url_hash == bindparam("url_hash")).order_by(models.Link.id)
+    if by_owner:
+        stmt = stmt.where(models.Link.owner_id == bindparam("owner_id"))
+    if active_only:
+        stmt = stmt.where((models.Link.expires_at.is_(None)) | (models.Link.expires_at > bindparam("now")))
+    return stmt
+
+_LINKS_BY_URL_QUERIES = {
+    (by_owner, active_only): _links_by_url_query(by_owner, active_only)
+    for by_owner in (False, True) for active_only in (False, True)
+}
+
+async def _find_link_by_url(
+    db: AsyncSession,
+    original_url: str,
+    owner_id: Optional[int] = None,
+    active_only: bool = False
+):
+    params = {"url_hash": url_digest(original_url)}
+    if owner_id is not None:
+        params["owner_id"] = owner_id
+    if active_only:
+        params["now"] = datetime.utcnow()
+    stmt = _LINKS_BY_URL_QUERIES[(owner_id is not None, active_only)]
+    target = normalize_url(original_url)
+    # Хэш 64-битный, поэтому совпавшие строки сверяем по самому URL
+    for candidate in await db.execute(stmt, params):
+        if normalize_url(candidate.original_url) == target:
+            return candidate
+    return None
+
 @app.post("/links/shorten", response_model=schemas.LinkResponse)
 async def create_short_link(
     link: schemas.LinkCreate,
-    db: Session = Depends(get_db),
+    dedupe: bool = Query(False),
+    db: AsyncSession = Depends(get_async_db),
     current_user: Optional[models.User] = Depends(get_current_active_user)
 ):
     logger.debug(f"Creating short link for URL: {link.original_url}, custom alias: {link.custom_alias}")
     if link.custom_alias:
-        existing_link = db.query(models.Link).filter(models.Link.custom_alias == link.custom_alias).first()
+        if allocator.owns(link.custom_alias):
+            raise HTTPException(status_code=400, detail="Custom alias looks like a generated code")
+        existing_link = await db.scalar(select(models.Link.id).where(models.Link.short_code == link.custom_alias))
         if existing_link:
             raise HTTPException(status_code=400, detail="Custom alias already in use")
         short_code = link.custom_alias
     else:
-        import secrets
-        import string
-        alphabet = string.ascii_letters + string.digits
-        short_code = ''.join(secrets.choice(alphabet) for _ in range(6))
+        if dedupe:
+            existing_link = await _find_link_by_url(db, str(link.original_url), owner_id=current_user.id, active_only=True)
+            if existing_link:
+                logger.debug(f"Returning existing link: {existing_link.short_code}")
+                return _link_result(existing_link)
+        short_code = await allocator.allocate(db)
     
     logger.debug(f"Using short code: {short_code}")
     logger.debug(f"Current user: {current_user.username if current_user else None}")
@@ -128,149 +250,303 @@ async def create_short_link(
         access_count=0
     )
     
+    await add_to_link_filter([short_code])
     logger.debug("Adding link to database")
     try:
         db.add(db_link)
-        db.commit()
+        await db.commit()
     except Exception as db_exc:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Database error creating short link: {db_exc}")
         raise HTTPException(status_code=500, detail="Database error occurred.")
     
     logger.debug("Link added to database")
-    db.refresh(db_link)
+    await db.refresh(db_link)
     
-    cache_data = {
-        "original_url": str(db_link.original_url),
-        "expires_at": db_link.expires_at.isoformat() if db_link.expires_at else None,
-        "access_count": db_link.access_count,
-        "last_accessed": db_link.last_accessed.isoformat() if db_link.last_accessed else None
-    }
-    set_cached_link(short_code, cache_data)
+    try:
+        await set_cached_link(short_code, db_link.original_url, db_link.expires_at)
+    except RedisError as e:
+        # Ссылка уже сохранена и есть в фильтре - при промахе её загрузят из БД
+        logger.warning(f"Could not cache new link {short_code}: {e}")
     
-    result = {
-        "original_url": db_link.original_url,
-        "short_code": db_link.short_code,
-        "custom_alias": db_link.custom_alias,
-        "created_at": db_link.created_at,
-        "expires_at": db_link.expires_at,
-        "last_accessed": db_link.last_accessed,
-        "access_count": db_link.access_count,
-        "owner_id": db_link.owner_id
-    }
+    result = _link_result(db_link)
     logger.debug(f"Returning link: {result}")
     return result
 
+async def _insert_link_rows(db: AsyncSession, rows: List[dict], items: List[schemas.LinkBatchItem]) -> None:
+    links = models.Link.__table__
+    try:
+        async with db.begin_nested():
+            await db.execute(insert(links).values(rows))
+        return
+    except IntegrityError:
+        pass
+    # Пачка упала на уникальности (алиас заняли параллельно) - ищем виноватых построчно
+    for row, item in zip(rows, items):
+        try:
+            async with db.begin_nested():
+                await db.execute(insert(links).values(row))
+        except IntegrityError:
+            item.short_code = None
+            item.error = "Custom alias already in use"
+
+@app.post("/links/shorten/batch", response_model=schemas.LinkBatchResponse)
+async def create_short_links_batch(
+    batch: schemas.LinkBatchCreate,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    if len(batch.links) > BATCH_SHORTEN_MAX:
+        raise HTTPException(status_code=400, detail=f"Too many links in batch (max {BATCH_SHORTEN_MAX})")
+
+    results = [
+        schemas.LinkBatchItem(
+            index=index,
+            original_url=str(link.original_url),
+            custom_alias=link.custom_alias,
+            expires_at=link.expires_at
+        )
+        for index, link in enumerate(batch.links)
+    ]
+
+    aliases = [link.custom_alias for link in batch.links if link.custom_alias]
+    taken = set()
+    for start in range(0, len(aliases), BATCH_INSERT_CHUNK):
+        chunk = aliases[start:start + BATCH_INSERT_CHUNK]
+        taken.update(await db.scalars(select(models.Link.short_code).where(models.Link.short_code.in_(chunk))))
+
+    generated = []
+    for item in results:
+        if item.custom_alias is None:
+            generated.append(item)
+        elif allocator.owns(item.custom_alias):
+            item.error = "Custom alias looks like a generated code"
+        elif item.custom_alias in taken:
+            item.error = "Custom alias already in use"
+        else:
+            item.short_code = item.custom_alias
+            taken.add(item.custom_alias)
+    for item, short_code in zip(generated, await allocator.allocate_many(db, len(generated))):
+        item.short_code = short_code
+
+    created_at = datetime.utcnow()
+    pending = [item for item in results if item.error is None]
+    for start in range(0, len(pending), BATCH_INSERT_CHUNK):
+        chunk = pending[start:start + BATCH_INSERT_CHUNK]
+        rows = [
+            {
+                "original_url": item.original_url,
+                "short_code": item.short_code,
+                "custom_alias": item.custom_alias,
+                "expires_at": item.expires_at,
+                "owner_id": current_user.id,
+                "created_at": created_at,
+                "access_count": 0
+            }
+            for item in chunk
+        ]
+        await _insert_link_rows(db, rows, chunk)
+    created = [item for item in pending if item.error is None]
+    await add_to_link_filter([item.short_code for item in created])
+    await db.commit()
+
+    try:
+        await set_cached_links(
+            {"short_code": item.short_code, "original_url": item.original_url, "expires_at": item.expires_at}
+            for item in created
+        )
+    except RedisError as e:
+        logger.warning(f"Could not cache {len(created)} new links: {e}")
+    return {"created": len(created), "failed": len(results) - len(created), "results": results}
+
 @app.get("/test")
 async def test_endpoint():
     return {"message": "Test endpoint works!"}
 
+@app.get("/cache/stats")
+async def get_cache_stats():
+    return local_cache.stats()
+
+@app.get("/admin/slow-requests")
+async def get_slow_requests(
+    route: Optional[str] = None,
+    limit: int = Query(10, ge=1, le=100),
+    current_user: models.User = Depends(get_current_admin_user)
+):
+    if not PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail="Profiling is disabled")
+    return slowest_requests(route, limit)
+
+@app.get("/metrics")
+async def get_metrics():
+    try:
+        task_stats = await get_task_stats()
+    except RedisError as e:
+        logger.warning(f"Could not read task metrics from Redis: {e}")
+        task_stats = {}
+    return Response(render(render_task_metrics(task_stats)), media_type="text/plain; version=0.0.4")
+
+LINK_LIST_COLUMNS = (models.Link.original_url, models.Link.short_code, models.Link.created_at)
+LINK_DETAIL_COLUMNS = (
+    models.Link.original_url,
+    models.Link.custom_alias,
+    models.Link.expires_at,
+    models.Link.short_code,
+    models.Link.created_at,
+    models.Link.last_accessed,
+    models.Link.access_count
+)
+
+async def _links_page(db: AsyncSession, columns, cursor: Optional[int], limit: int, response: Response) -> List[dict]:
+    stmt = select(models.Link.id, *columns).order_by(models.Link.id).limit(limit + 1)
+    if cursor is not None:
+        stmt = stmt.where(models.Link.id > cursor)
+    rows = (await db.execute(stmt)).mappings().all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Cursor"] = str(rows[-1]["id"])
+    return [{key: row[key] for key in row.keys() if key != "id"} for row in rows]
+
 @app.get("/links")
-async def list_links(db: Session = Depends(get_db)):
-    links = db.query(models.Link).all()
-    return [
-        {
-            "original_url": link.original_url,
-            "short_code": link.short_code,
-            "created_at": link.created_at
-        }
-        for link in links
-    ]
+async def list_links(
+    response: Response,
+    cursor: Optional[int] = Query(None, ge=0),
+    limit: int = Query(LINK_PAGE_SIZE, ge=1, le=LINK_PAGE_SIZE_MAX),
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    return await _links_page(db, LINK_LIST_COLUMNS, cursor, limit, response)
+
+@app.get("/all-links")
+async def get_all_links(
+    response: Response,
+    cursor: Optional[int] = Query(None, ge=0),
+    limit: int = Query(LINK_PAGE_SIZE, ge=1, le=LINK_PAGE_SIZE_MAX),
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    try:
+        return await _links_page(db, LINK_DETAIL_COLUMNS, cursor, limit, response)
+    except Exception as e:
+        logger.error("Error getting all links", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+@app.get("/links/export")
+async def export_links(db: AsyncSession = Depends(get_async_read_db)):
+    bind = db.bind
+
+    # Сессия запроса закрывается до отправки тела, поэтому поток читает через свою
+    async def rows():
+        async with AsyncSession(bind) as stream_db:
+            result = await stream_db.stream(
+                select(*LINK_DETAIL_COLUMNS).order_by(models.Link.id).execution_options(yield_per=LINK_EXPORT_BATCH)
+            )
+            async for partition in result.mappings().partitions():
+                yield "".join(json.dumps(dict(row), default=_json_default) + "\n" for row in partition)
+
+    return StreamingResponse(rows(), media_type="application/x-ndjson")
 
-@app.get("/links/search")
-async def search_link(original_url: str, db: Session = Depends(get_db)):
-    link = db.query(models.Link).filter(models.Link.original_url == original_url).first()
+@app.get("/links/search", response_model=schemas.LinkResponse)
+async def search_link(original_url: str, db: AsyncSession = Depends(get_async_read_db)):
+    link = await _find_link_by_url(db, original_url)
     if not link:
         raise HTTPException(status_code=404, detail="Link not found")
-    return link
+    return _link_result(link)
+
+LINK_STATS_QUERY = select(
+    models.Link.original_url,
+    models.Link.short_code,
+    models.Link.created_at,
+    models.Link.expires_at,
+    models.Link.last_accessed,
+    models.Link.access_count
+).where(models.Link.short_code == bindparam("short_code"))
 
 @app.get("/links/{short_code}/stats", response_model=schemas.LinkStats)
-async def get_link_stats_endpoint(short_code: str, db: Session = Depends(get_db)):
-    link = db.query(models.Link).filter(models.Link.short_code == short_code).first()
+async def get_link_stats_endpoint(short_code: str, db: AsyncSession = Depends(get_async_read_db)):
+    link = (await db.execute(LINK_STATS_QUERY, {"short_code": short_code})).first()
     if not link:
         raise HTTPException(status_code=404, detail="Link not found")
     
-    cached_stats = get_link_stats(short_code)
-    if cached_stats:
-        link.access_count = cached_stats.get("access_count", link.access_count)
-    
+    clicks = await get_click_stats(short_code)
+    last_accessed = link.last_accessed
+    if clicks["last_accessed"] and (not last_accessed or clicks["last_accessed"] > last_accessed):
+        last_accessed = clicks["last_accessed"]
+
     return {
         "original_url": link.original_url,
         "custom_alias": None,
         "short_code": link.short_code,
         "created_at": link.created_at,
         "expires_at": link.expires_at,
-        "last_accessed": link.last_accessed,
-        "access_count": link.access_count
+        "last_accessed": last_accessed,
+        "access_count": link.access_count + clicks["access_count"]
     }
 
+LINK_ID_QUERY = select(models.Link.id).where(models.Link.short_code == bindparam("short_code"))
+
+@app.get("/links/{short_code}/analytics", response_model=schemas.LinkAnalytics)
+async def get_link_analytics(short_code: str, db: AsyncSession = Depends(get_async_read_db)):
+    link_id = await db.scalar(LINK_ID_QUERY, {"short_code": short_code})
+    if link_id is None:
+        raise HTTPException(status_code=404, detail="Link not found")
+    return {"short_code": short_code, **await get_click_analytics(short_code)}
+
 @app.get("/{short_code}")
 @app.head("/{short_code}")
-async def redirect_to_url(short_code: str, db: Session = Depends(get_db)):
-
-    cached_link = get_cached_link(short_code)
-    if cached_link:
-        if cached_link["expires_at"]:
-            expires_at = datetime.fromisoformat(cached_link["expires_at"])
-            if datetime.utcnow() > expires_at:
-                delete_cached_link(short_code)
-                raise HTTPException(status_code=404, detail="Link has expired")
-        
-        increment_access_count(short_code)
-        cached_link["access_count"] += 1
-        cached_link["last_accessed"] = datetime.utcnow().isoformat()
-        set_cached_link(short_code, cached_link)
-        
-        return RedirectResponse(url=cached_link["original_url"])
-    
-    link = db.query(models.Link).filter(models.Link.short_code == short_code).first()
-    if not link:
-        raise HTTPException(status_code=404, detail="Link not found")
-    
-    if link.expires_at and datetime.utcnow() > link.expires_at:
-        db.delete(link)
-        db.commit()
+async def redirect_to_url(short_code: str, request: Request):
+
+    fingerprint = client_fingerprint(request.client.host if request.client else "", request.headers.get("user-agent", ""))
+    cached_url = None
+    # RedirectFastPath уже проверил кэш и промахнулся - сразу идём в БД
+    if not request.scope.get(CACHE_MISS_SCOPE_KEY):
+        try:
+            cached_url = await resolve_redirect(short_code, fingerprint)
+        except RedisError as e:
+            logger.warning(f"Redirect cache is unavailable: {e}")
+    if cached_url is None:
+        # Загрузка общая для одновременных промахов и сама кладёт ссылку в кэш
+        cached_url = await link_loader.load(short_code)
+        if isinstance(cached_url, str):
+            try:
+                await record_click(short_code, fingerprint=fingerprint)
+            except RedisError as e:
+                logger.warning(f"Could not record click for {short_code}: {e}")
+    if cached_url == LINK_EXPIRED:
         raise HTTPException(status_code=404, detail="Link has expired")
-    
-    link.access_count += 1
-    link.last_accessed = datetime.utcnow()
-    db.commit()
-    
-    link_data = {
-        "original_url": link.original_url,
-        "expires_at": link.expires_at.isoformat() if link.expires_at else None,
-        "access_count": link.access_count,
-        "last_accessed": link.last_accessed.isoformat()
-    }
-    set_cached_link(short_code, link_data)
-    
-    return RedirectResponse(url=link.original_url)
+    if cached_url == LINK_NOT_FOUND:
+        raise HTTPException(status_code=404, detail="Link not found")
+    return RedirectResponse(url=cached_url)
 
 @app.delete("/links/{short_code}")
 async def delete_link(
     short_code: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
-    link = db.query(models.Link).filter(models.Link.short_code == short_code).first()
+    link = await db.scalar(select(models.Link).where(models.Link.short_code == short_code))
     if not link:
         raise HTTPException(status_code=404, detail="Link not found")
     
     if link.owner_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not authorized to delete this link")
 
-    db.delete(link)
-    db.commit()
+    await db.delete(link)
+    await db.commit()
+    await delete_cached_link(short_code)
     return {"message": "Link deleted successfully"}
 
 @app.put("/links/{short_code}", response_model=schemas.LinkResponse)
 async def update_link(
     short_code: str,
     link_update: schemas.LinkUpdate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
-    db_link = db.query(models.Link).filter(models.Link.short_code == short_code).first()
+    db_link = await db.scalar(select(models.Link).where(models.Link.short_code == short_code))
     if not db_link:
         raise HTTPException(status_code=404, detail="Link not found")
     
@@ -279,33 +555,11 @@ async def update_link(
     
     if link_update.original_url is not None:
         db_link.original_url = link_update.original_url
+        db_link.url_hash = url_digest(link_update.original_url)
     if link_update.expires_at is not None:
         db_link.expires_at = link_update.expires_at
 
-    db.commit()
-    db.refresh(db_link)
+    await db.commit()
+    await db.refresh(db_link)
+    await replace_cached_link(short_code, db_link.original_url, db_link.expires_at)
     return db_link
-
-@app.get("/all-links")
-async def get_all_links(db: Session = Depends(get_db)):
-    try:
-        logger.debug("Getting all links")
-        links = db.query(models.Link).all()
-        logger.debug(f"Found {len(links)} links")
-        result = [
-            {
-                "original_url": link.original_url,
-                "custom_alias": None,
-                "expires_at": link.expires_at,
-                "short_code": link.short_code,
-                "created_at": link.created_at,
-                "last_accessed": link.last_accessed,
-                "access_count": link.access_count
-            }
-            for link in links
-        ]
-        logger.debug(f"Returning result: {result}")
-        return result
-    except Exception as e:
-        logger.error("Error getting all links", exc_info=True)
-        raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
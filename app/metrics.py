@@ -0,0 +1,293 @@
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from fastapi.responses import JSONResponse
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+# Метрики процесса в текстовом формате Prometheus. Запись - без блокировок:
+# всё, что их пишет, выполняется в потоке event loop (или в единственном потоке задачи Celery).
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], "_CounterChild"] = {}
+
+    def labels(self, *values: str) -> "_CounterChild":
+        child = self._children.get(values)
+        if child is None:
+            child = self._children.setdefault(tuple(values), _CounterChild())
+        return child
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    def collect(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        for values, child in list(self._children.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._children: Dict[Tuple[str, ...], "_HistogramChild"] = {}
+
+    def labels(self, *values: str) -> "_HistogramChild":
+        child = self._children.get(values)
+        if child is None:
+            child = self._children.setdefault(tuple(values), _HistogramChild(self.buckets))
+        return child
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def collect(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        for values, child in list(self._children.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, child.counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, values, f'le="{bound}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, values, 'le="+Inf"')
+            yield f"{self.name}_bucket{labels} {child.count}"
+            labels = _format_labels(self.labelnames, values)
+            yield f"{self.name}_sum{labels} {_format_value(child.sum)}"
+            yield f"{self.name}_count{labels} {child.count}"
+
+class _HistogramChild:
+    __slots__ = ("_buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self._buckets = buckets
+        # Последняя ячейка - значения больше верхней границы
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self._buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class Gauge:
+    """Значение вычисляется при сборе: callback возвращает пары (значения меток, число)."""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str],
+        callback: Callable[[], Iterable[Tuple[Sequence[str], float]]]
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+
+    def collect(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} gauge"
+        for values, value in self.callback():
+            yield f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(value)}"
+
+REGISTRY: List = []
+
+def register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+def render(extra: Iterable[str] = ()) -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.collect())
+    lines.extend(extra)
+    return "\n".join(lines) + "\n"
+
+HTTP_REQUEST_DURATION = register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "route")
+))
+HTTP_REQUESTS = register(Counter(
+    "http_requests_total", "HTTP requests by route and status", ("method", "route", "status")
+))
+HTTP_REQUEST_DB_QUERIES = register(Histogram(
+    "http_request_db_queries", "DB queries per HTTP request", ("route",), buckets=COUNT_BUCKETS
+))
+HTTP_REQUEST_DB_SECONDS = register(Histogram(
+    "http_request_db_seconds", "Total DB query time per HTTP request", ("route",)
+))
+CACHE_LOOKUPS = register(Counter(
+    "cache_lookups_total", "Link cache lookups by operation and result", ("op", "result")
+))
+REDIS_COMMAND_DURATION = register(Histogram(
+    "redis_command_duration_seconds", "Redis round-trip time by command", ("command",)
+))
+LINK_LOADER_REQUESTS = register(Counter(
+    "link_loader_requests_total",
+    "Cache-miss link loads: coalesced into an in-flight load or queued for a batch",
+    ("outcome",)
+))
+LINK_LOADER_BATCH_SIZE = register(Histogram(
+    "link_loader_batch_size", "Short codes per batched DB load", buckets=COUNT_BUCKETS
+))
+DB_QUERY_DURATION = register(Histogram(
+    "db_query_duration_seconds", "DB query execution time", ("engine",)
+))
+
+# Время текущего HTTP-запроса по фазам (db, redis, auth, serialization): {фаза: [количество, секунды]}
+_request_phases: ContextVar[Optional[Dict[str, List[float]]]] = ContextVar("request_phases", default=None)
+
+def add_request_time(phase: str, seconds: float) -> None:
+    phases = _request_phases.get()
+    if phases is None:
+        return
+    entry = phases.get(phase)
+    if entry is None:
+        phases[phase] = [1, seconds]
+    else:
+        entry[0] += 1
+        entry[1] += seconds
+
+def current_request_phases() -> Optional[Dict[str, List[float]]]:
+    return _request_phases.get()
+
+_engines: Dict[str, object] = {}
+
+def instrument_engine(name: str, engine) -> None:
+    """Вешает на синхронный Engine (для async - engine.sync_engine) замер запросов и метрики пула."""
+    histogram = DB_QUERY_DURATION.labels(name)
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        histogram.observe(elapsed)
+        add_request_time("db", elapsed)
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(exception_context):
+        connection = exception_context.connection
+        if connection is not None and connection.info.get("query_started"):
+            connection.info["query_started"].pop()
+
+    _engines[name] = engine
+
+def _pool_samples():
+    for name, engine in _engines.items():
+        pool = engine.pool
+        # Счётчики есть только у QueuePool (и его async-варианта), у StaticPool/NullPool их нет
+        if not isinstance(pool, QueuePool):
+            continue
+        yield (name, "size"), pool.size()
+        yield (name, "checked_out"), pool.checkedout()
+        yield (name, "checked_in"), pool.checkedin()
+        yield (name, "overflow"), pool.overflow()
+
+register(Gauge("db_pool_connections", "Engine pool connections by state", ("engine", "state"), _pool_samples))
+
+class TimedJSONResponse(JSONResponse):
+    """JSONResponse, который учитывает время сериализации тела в фазе serialization."""
+
+    def render(self, content) -> bytes:
+        started = time.perf_counter()
+        body = super().render(content)
+        add_request_time("serialization", time.perf_counter() - started)
+        return body
+
+def _route_name(scope) -> str:
+    route = scope.get("route")
+    return route.path if route is not None else "unmatched"
+
+class MetricsMiddleware:
+    """ASGI-middleware: латентность и статус по шаблону маршрута, число и время запросов к БД.
+
+    Заодно открывает для запроса счётчики фаз (add_request_time), их читает ProfilingMiddleware.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        phases: Dict[str, List[float]] = {}
+        token = _request_phases.set(phases)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            _request_phases.reset(token)
+            route = _route_name(scope)
+            method = scope["method"]
+            HTTP_REQUEST_DURATION.labels(method, route).observe(elapsed)
+            HTTP_REQUESTS.labels(method, route, str(status_code)).inc()
+            db_count, db_seconds = phases.get("db", (0, 0.0))
+            HTTP_REQUEST_DB_QUERIES.labels(route).observe(db_count)
+            HTTP_REQUEST_DB_SECONDS.labels(route).observe(db_seconds)
+
+def render_task_metrics(task_stats: Dict[str, Dict[str, float]]) -> List[str]:
+    """Метрики задач Celery: они выполняются в других процессах, поэтому приходят из Redis."""
+    lines = []
+    families = (
+        ("celery_task_runs_total", "counter", "Celery task runs", "runs"),
+        ("celery_task_seconds_total", "counter", "Total Celery task run time", "seconds"),
+        ("celery_task_last_seconds", "gauge", "Duration of the last Celery task run", "last_seconds"),
+        ("celery_task_rows_deleted_total", "counter", "Rows deleted by cleanup tasks", "deleted"),
+    )
+    for name, kind, documentation, field in families:
+        lines.append(f"# HELP {name} {documentation}")
+        lines.append(f"# TYPE {name} {kind}")
+        for task, stats in sorted(task_stats.items()):
+            if field in stats:
+                lines.append(f'{name}{{task="{task}"}} {_format_value(stats[field])}')
+    return lines
@@ -1,7 +1,11 @@
-from sqlalchemy import Column, Integer, String, DateTime, BigInteger, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, BigInteger, ForeignKey, Boolean, Index
 from sqlalchemy.orm import relationship
 import datetime
 from .database import Base
+from .urls import url_digest
+
+def _original_url_digest(context):
+    return url_digest(context.get_current_parameters()["original_url"])
 
 class User(Base):
     __tablename__ = "users"
@@ -17,16 +21,21 @@ class Link(Base):
     __tablename__ = "links"
 
     id = Column(Integer, primary_key=True, index=True)
-    original_url = Column(String, index=True)
+    original_url = Column(String)
+    url_hash = Column(BigInteger, default=_original_url_digest)
     short_code = Column(String, unique=True, index=True)
     custom_alias = Column(String, unique=True, nullable=True)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
-    expires_at = Column(DateTime, nullable=True)
-    last_accessed = Column(DateTime, nullable=True)
+    expires_at = Column(DateTime, nullable=True, index=True)
+    last_accessed = Column(DateTime, nullable=True, index=True)
     access_count = Column(Integer, default=0)
     owner_id = Column(Integer, ForeignKey("users.id"), nullable=True)
     owner = relationship("User", back_populates="links")
 
+    __table_args__ = (
+        Index("ix_links_url_hash_owner_id", "url_hash", "owner_id"),
+    )
+
 class Settings(Base):
     __tablename__ = "settings"
     
@@ -35,4 +44,10 @@ class Settings(Base):
     value = Column(String)
     description = Column(String, nullable=True)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow) 
\ No newline at end of file
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow) 
+
+class ShortCodeSequence(Base):
+    __tablename__ = "short_code_sequences"
+
+    name = Column(String, primary_key=True)
+    next_value = Column(BigInteger, nullable=False, default=0)
@@ -0,0 +1,164 @@
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from app.metrics import current_request_phases
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0") == "1"
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", 0.01))
+PROFILING_SLOW_MS = float(os.getenv("PROFILING_SLOW_MS", 250))
+PROFILING_STACK_INTERVAL_MS = float(os.getenv("PROFILING_STACK_INTERVAL_MS", 5))
+PROFILING_LOG_PATH = os.getenv("PROFILING_LOG_PATH", "slow_requests.log")
+PROFILING_LOG_MAX_BYTES = int(os.getenv("PROFILING_LOG_MAX_BYTES", 10 * 1024 * 1024))
+PROFILING_LOG_BACKUPS = int(os.getenv("PROFILING_LOG_BACKUPS", 3))
+PROFILING_RECENT_PER_ROUTE = int(os.getenv("PROFILING_RECENT_PER_ROUTE", 50))
+
+logger = logging.getLogger(__name__)
+
+class StackSampler:
+    """Фоновый поток, который снимает стек потока event loop, пока идёт хотя бы один отобранный запрос.
+
+    Снимки копятся в кольцевом буфере; для медленного запроса берутся снимки за время его выполнения.
+    На event loop выполняются и соседние запросы, поэтому профиль - картина всего цикла за это время.
+    """
+
+    def __init__(self, interval: float, capacity: int = 4000):
+        self.interval = interval
+        self._samples: Deque[Tuple[float, str]] = deque(maxlen=capacity)
+        self._active = 0
+        self._target: Optional[int] = None
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, thread_id: int) -> None:
+        self._target = thread_id
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+            self._thread.start()
+
+    def begin(self) -> None:
+        self._active += 1
+        self._wakeup.set()
+
+    def end(self) -> None:
+        self._active -= 1
+        if self._active <= 0:
+            self._active = 0
+            self._wakeup.clear()
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait()
+            frame = sys._current_frames().get(self._target)
+            if frame is not None:
+                self._samples.append((time.perf_counter(), _collapse(frame)))
+            time.sleep(self.interval)
+
+    def profile(self, started: float, finished: float, top: int = 20) -> List[Dict[str, Any]]:
+        stacks = Counter(stack for at, stack in list(self._samples) if started <= at <= finished)
+        return [{"stack": stack, "samples": count} for stack, count in stacks.most_common(top)]
+
+def _collapse(frame) -> str:
+    # Стек в свёрнутом формате flamegraph: внешние кадры слева, через ";"
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+_recent: Dict[str, Deque[Dict[str, Any]]] = defaultdict(lambda: deque(maxlen=PROFILING_RECENT_PER_ROUTE))
+_sampler = StackSampler(PROFILING_STACK_INTERVAL_MS / 1000)
+_slow_log: Optional[logging.Logger] = None
+
+def _get_slow_log() -> logging.Logger:
+    global _slow_log
+    if _slow_log is None:
+        _slow_log = logging.getLogger("app.slow_requests")
+        _slow_log.propagate = False
+        handler = RotatingFileHandler(
+            PROFILING_LOG_PATH, maxBytes=PROFILING_LOG_MAX_BYTES, backupCount=PROFILING_LOG_BACKUPS
+        )
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        _slow_log.addHandler(handler)
+        _slow_log.setLevel(logging.INFO)
+    return _slow_log
+
+def slowest_requests(route: Optional[str] = None, limit: int = 10) -> Dict[str, List[Dict[str, Any]]]:
+    routes = [route] if route is not None else list(_recent)
+    result = {}
+    for name in routes:
+        records = sorted(_recent.get(name, ()), key=lambda record: record["duration_ms"], reverse=True)
+        if records:
+            result[name] = [{key: value for key, value in record.items() if key != "profile"} for record in records[:limit]]
+    return result
+
+def reset() -> None:
+    _recent.clear()
+
+class ProfilingMiddleware:
+    """Отбирает PROFILING_SAMPLE_RATE запросов; отобранные медленнее PROFILING_SLOW_MS
+    пишутся с временем по фазам и профилем стека в ротируемый файл PROFILING_LOG_PATH.
+
+    Подключается только при PROFILING_ENABLED=1 и должна стоять внутри MetricsMiddleware:
+    фазы (db, redis, auth, password, serialization) считает она.
+    """
+
+    def __init__(self, app, sample_rate: float = PROFILING_SAMPLE_RATE, slow_ms: float = PROFILING_SLOW_MS):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or random.random() >= self.sample_rate:
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        _sampler.start(threading.get_ident())
+        _sampler.begin()
+        phases = current_request_phases()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            finished = time.perf_counter()
+            _sampler.end()
+            duration_ms = (finished - started) * 1000
+            if duration_ms >= self.slow_ms:
+                self._capture(scope, status_code, duration_ms, phases or {}, started, finished)
+
+    def _capture(self, scope, status_code: int, duration_ms: float, phases, started: float, finished: float) -> None:
+        route = scope.get("route")
+        route = route.path if route is not None else "unmatched"
+        record = {
+            "at": datetime.utcnow().isoformat(),
+            "method": scope["method"],
+            "route": route,
+            "path": scope["path"],
+            "status": status_code,
+            "duration_ms": round(duration_ms, 3),
+            "phases_ms": {name: round(seconds * 1000, 3) for name, (_, seconds) in phases.items()},
+            "phase_calls": {name: int(count) for name, (count, _) in phases.items()},
+            "profile": _sampler.profile(started, finished)
+        }
+        _recent[route].append(record)
+        try:
+            _get_slow_log().info(json.dumps(record))
+        except OSError as e:
+            logger.warning(f"Could not write slow request log: {e}")
@@ -1,33 +0,0 @@
-import redis
-import os
-from dotenv import load_dotenv
-import json
-from datetime import datetime
-from typing import Optional, Dict, Any
-
-load_dotenv()
-
-redis_client = redis.Redis(
-    host=os.getenv("REDIS_HOST", "localhost"),
-    port=int(os.getenv("REDIS_PORT", 6379)),
-    db=0,
-    decode_responses=True
-)
-
-def get_cached_link(short_code: str) -> Optional[Dict[str, Any]]:
-    return None
-
-def set_cached_link(short_code: str, link_data: Dict[str, Any]) -> None:
-    pass
-
-def delete_cached_link(short_code: str) -> None:
-    pass
-
-def increment_access_count(short_code: str) -> None:
-    pass
-
-def get_link_stats(short_code: str) -> Optional[Dict[str, Any]]:
-    return None
-
-def set_link_stats(short_code: str, stats: Dict[str, Any]) -> None:
-    pass 
\ No newline at end of file
@@ -1,6 +1,6 @@
 from pydantic import BaseModel, EmailStr
 from datetime import datetime
-from typing import Optional
+from typing import Optional, List
 
 class UserBase(BaseModel):
     username: str
@@ -31,6 +31,22 @@ class LinkBase(BaseModel):
 class LinkCreate(LinkBase):
     pass
 
+class LinkBatchCreate(BaseModel):
+    links: List[LinkCreate]
+
+class LinkBatchItem(BaseModel):
+    index: int
+    original_url: str
+    short_code: Optional[str] = None
+    custom_alias: Optional[str] = None
+    expires_at: Optional[datetime] = None
+    error: Optional[str] = None
+
+class LinkBatchResponse(BaseModel):
+    created: int
+    failed: int
+    results: List[LinkBatchItem]
+
 class LinkUpdate(BaseModel):
     original_url: Optional[str] = None
     expires_at: Optional[datetime] = None
@@ -48,6 +64,17 @@ class LinkResponse(LinkBase):
 class LinkStats(LinkResponse):
     pass
 
+class ClickBucket(BaseModel):
+    start: datetime
+    clicks: int
+
+class LinkAnalytics(BaseModel):
+    short_code: str
+    unique_visitors: int
+    minutes: List[ClickBucket]
+    hours: List[ClickBucket]
+    days: List[ClickBucket]
+
 class SettingsBase(BaseModel):
     key: str
     value: str
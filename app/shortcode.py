@@ -0,0 +1,164 @@
+import asyncio
+import hashlib
+import os
+import string
+from typing import List, Optional
+
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import cache
+import app.models as models
+
+ALPHABET = string.digits + string.ascii_letters
+BASE = len(ALPHABET)
+
+def encode_base62(value: int, length: int) -> str:
+    chars = []
+    for _ in range(length):
+        value, digit = divmod(value, BASE)
+        chars.append(ALPHABET[digit])
+    return ''.join(reversed(chars))
+
+def _feistel(value: int, half_bits: int, key: bytes, rounds: int = 4) -> int:
+    mask = (1 << half_bits) - 1
+    left, right = value >> half_bits, value & mask
+    for round_number in range(rounds):
+        digest = hashlib.blake2b(
+            right.to_bytes(8, "big") + bytes([round_number]), key=key, digest_size=8
+        ).digest()
+        left, right = right, left ^ (int.from_bytes(digest, "big") & mask)
+    return (left << half_bits) | right
+
+def permute(index: int, space: int, key: bytes) -> int:
+    # Сеть Фейстеля на 2^k >= space с cycle walking - биекция на [0, space)
+    half_bits = ((space - 1).bit_length() + 1) // 2
+    value = _feistel(index, half_bits, key)
+    while value >= space:
+        value = _feistel(value, half_bits, key)
+    return value
+
+class DatabaseBlockSource:
+    """Выдаёт блоки номеров из строки short_code_sequences (hi/lo).
+
+    Аренда коммитится в отдельной сессии, чтобы откат запроса не вернул
+    уже выданный процессу блок.
+    """
+
+    def __init__(self, name: str = "links"):
+        self.name = name
+
+    async def lease(self, db: AsyncSession, size: int) -> int:
+        stmt = (
+            update(models.ShortCodeSequence)
+            .where(models.ShortCodeSequence.name == self.name)
+            .values(next_value=models.ShortCodeSequence.next_value + size)
+            .returning(models.ShortCodeSequence.next_value)
+        )
+        async with AsyncSession(db.bind) as lease_db:
+            end = await lease_db.scalar(stmt)
+            if end is None:
+                lease_db.add(models.ShortCodeSequence(name=self.name, next_value=size))
+                try:
+                    await lease_db.commit()
+                    return 0
+                except IntegrityError:
+                    await lease_db.rollback()
+                    end = await lease_db.scalar(stmt)
+            await lease_db.commit()
+            return end - size
+
+class RedisBlockSource:
+    def __init__(self, key: str = "shortcode:hi"):
+        self.key = key
+
+    async def lease(self, db: AsyncSession, size: int) -> int:
+        end = await cache.get_redis().incrby(self.key, size)
+        return end - size
+
+class ShortCodeAllocator:
+    """Выдаёт короткие коды из счётчика, арендуя блоки номеров у block_source.
+
+    Код - это номер в base62 и контрольный символ, вычисленный по номеру с ключом.
+    Номера делятся на ярусы по длине кода: первые 62^(min_length-1) номеров дают
+    коды длины min_length, следующие 62^min_length - на символ длиннее и т.д.
+    Внутри яруса номер перемешивается ключевой перестановкой, поэтому коды
+    не идут подряд, но остаются уникальными без проверок в БД.
+
+    По контрольному символу owns отличает коды счётчика от пользовательских алиасов:
+    с ним совпадает лишь каждый 62-й алфавитно-цифровой алиас не короче min_length.
+    Старые случайные коды были длиной 6 символов, поэтому при min_length 7 счётчик с ними не пересекается.
+    """
+
+    def __init__(
+        self,
+        block_source,
+        block_size: int = 1000,
+        min_length: int = 7,
+        scramble_key: Optional[bytes] = None
+    ):
+        self.block_source = block_source
+        self.block_size = block_size
+        self.min_length = min_length
+        self.scramble_key = scramble_key
+        self._next = 0
+        self._end = 0
+        self._lock = asyncio.Lock()
+
+    def _check_char(self, body: str) -> str:
+        digest = hashlib.blake2b(body.encode(), key=self.scramble_key or b"", digest_size=8).digest()
+        return ALPHABET[int.from_bytes(digest, "big") % BASE]
+
+    def code_for(self, number: int) -> str:
+        length = self.min_length - 1
+        space = BASE ** length
+        while number >= space:
+            number -= space
+            length += 1
+            space = BASE ** length
+        if self.scramble_key:
+            number = permute(number, space, self.scramble_key)
+        body = encode_base62(number, length)
+        return body + self._check_char(body)
+
+    def owns(self, code: str) -> bool:
+        # Такой код рано или поздно выдаст счётчик, поэтому занимать его псевдонимом нельзя
+        return (
+            len(code) >= self.min_length
+            and all(char in ALPHABET for char in code)
+            and code[-1] == self._check_char(code[:-1])
+        )
+
+    async def allocate(self, db: AsyncSession) -> str:
+        return (await self.allocate_many(db, 1))[0]
+
+    async def allocate_many(self, db: AsyncSession, count: int) -> List[str]:
+        numbers = []
+        async with self._lock:
+            while len(numbers) < count:
+                if self._next >= self._end:
+                    size = max(self.block_size, count - len(numbers))
+                    self._next = await self.block_source.lease(db, size)
+                    self._end = self._next + size
+                take = min(count - len(numbers), self._end - self._next)
+                numbers.extend(range(self._next, self._next + take))
+                self._next += take
+        return [self.code_for(number) for number in numbers]
+
+    def reset(self) -> None:
+        self._next = 0
+        self._end = 0
+
+def _scramble_key() -> Optional[bytes]:
+    if os.getenv("SHORTCODE_SCRAMBLE", "1") != "1":
+        return None
+    secret = os.getenv("SHORTCODE_SECRET", os.getenv("SECRET_KEY", "url-shortener"))
+    return hashlib.blake2b(secret.encode(), digest_size=32).digest()
+
+allocator = ShortCodeAllocator(
+    RedisBlockSource() if os.getenv("SHORTCODE_BLOCK_SOURCE", "db") == "redis" else DatabaseBlockSource(),
+    block_size=int(os.getenv("SHORTCODE_BLOCK_SIZE", 1000)),
+    min_length=int(os.getenv("SHORTCODE_MIN_LENGTH", 7)),
+    scramble_key=_scramble_key()
+)
@@ -1,14 +1,97 @@
+import asyncio
+import os
+import time
 from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import bindparam, delete, select, update
 from sqlalchemy.orm import Session
 from . import models, crud
+from .urls import url_digest
 from .database import SessionLocal
+from celery.signals import worker_ready
 from app.celery_app import celery_app
-from app.redis_client import delete_cached_link
+from app.cache import (
+    delete_cached_links, click_flush_lock, iter_dirty_links, get_pending_clicks, ack_flushed_clicks, task_redis_client,
+    rebuild_link_filter, link_filter_ready, link_filter_lock, record_task_run, warm_link_cache,
+    schedule_link_expiries, get_due_expiries, ack_expiries,
+    TOMBSTONE_DELETED, TOMBSTONE_EXPIRED, CLICK_FLUSH_LOCK_TTL,
+    WARMUP_TOP_N, WARMUP_RECENT_DAYS, WARMUP_BATCH_SIZE
+)
 import logging
 
 logger = logging.getLogger(__name__)
 
-def cleanup_unused_links():
+CLEANUP_BATCH_SIZE = int(os.getenv("CLEANUP_BATCH_SIZE", 1000))
+EXPIRY_BATCH_SIZE = int(os.getenv("EXPIRY_BATCH_SIZE", 100))
+# Сколько вперёд досылать сроки в очередь истечения при полной очистке (она же страховка на случай потери очереди)
+EXPIRY_REQUEUE_HORIZON = int(os.getenv("EXPIRY_REQUEUE_HORIZON", 2 * 86400))
+
+def run_async(coro):
+    # Каждый запуск задачи идёт в своём event loop, поэтому и пул Redis у него свой
+    async def runner():
+        async with task_redis_client():
+            return await coro
+    return asyncio.run(runner())
+
+async def _delete_links_in_batches(db: Session, condition, batch_size: int, tombstone: str) -> dict:
+    """Удаляет подходящие ссылки пачками по batch_size, каждая пачка - отдельная короткая транзакция."""
+    links = models.Link.__table__
+    started = time.monotonic()
+    deleted = 0
+    batches = 0
+    while True:
+        batch_ids = select(links.c.id).where(condition).limit(batch_size)
+        short_codes = db.scalars(
+            delete(links).where(links.c.id.in_(batch_ids)).returning(links.c.short_code)
+        ).all()
+        db.commit()
+        if not short_codes:
+            break
+        await delete_cached_links(short_codes, tombstone)
+        deleted += len(short_codes)
+        batches += 1
+    elapsed = time.monotonic() - started
+    return {
+        "deleted": deleted,
+        "batches": batches,
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(deleted / elapsed, 1) if elapsed > 0 else 0.0
+    }
+
+def _run_cleanup(name: str, condition, batch_size: int, tombstone: str, before=None) -> dict:
+    db = SessionLocal()
+    try:
+        async def cleanup():
+            if before is not None:
+                await before(db)
+            report = await _delete_links_in_batches(db, condition, batch_size, tombstone)
+            await record_task_run(f"cleanup_{name}_links", report["seconds"], report["deleted"])
+            return report
+
+        report = run_async(cleanup())
+        logger.info(
+            f"Deleted {report['deleted']} {name} links in {report['batches']} batches "
+            f"({report['rows_per_second']} rows/sec)"
+        )
+        return report
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error cleaning up {name} links: {e}")
+        raise
+    finally:
+        db.close()
+
+def _inactive_condition(days: int):
+    cutoff_date = datetime.utcnow() - timedelta(days=days)
+    # Ссылки, по которым ни разу не переходили (last_accessed IS NULL), не трогаем
+    return models.Link.__table__.c.last_accessed <= cutoff_date
+
+async def _flush_before_cleanup(db: Session) -> None:
+    # Свежие переходы могли ещё не дойти до last_accessed в БД; идущий сброс дожидаемся
+    if await _flush_click_counters(db, CLEANUP_BATCH_SIZE, wait=CLICK_FLUSH_LOCK_TTL) is None:
+        raise RuntimeError("Click counters are still being flushed by another worker")
+
+def cleanup_unused_links(batch_size=CLEANUP_BATCH_SIZE):
     db = SessionLocal()
     try:
         settings = crud.get_setting(db, "unused_links_days")
@@ -24,64 +107,251 @@ def cleanup_unused_links():
             days = 30
         else:
             days = int(settings.value)
+    finally:
+        db.close()
+    return cleanup_inactive_links(days=days, batch_size=batch_size)
 
-        cutoff_date = datetime.utcnow() - timedelta(days=days)
-        unused_links = db.query(models.Link).filter(
-            models.Link.last_used_at < cutoff_date,
-            models.Link.last_used_at.isnot(None)  # Исключаем ссылки, которые никогда не использовались
+async def _requeue_upcoming_expiries(db: Session) -> None:
+    # После перезапуска Redis очередь истечения пуста - восстанавливаем её для ближайших сроков
+    links = models.Link.__table__
+    now = datetime.utcnow()
+    last_id = 0
+    while True:
+        rows = db.execute(
+            select(links.c.id, links.c.short_code, links.c.expires_at)
+            .where(
+                links.c.expires_at > now,
+                links.c.expires_at <= now + timedelta(seconds=EXPIRY_REQUEUE_HORIZON),
+                links.c.id > last_id
+            )
+            .order_by(links.c.id)
+            .limit(CLEANUP_BATCH_SIZE)
         ).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        await schedule_link_expiries([(row.short_code, row.expires_at) for row in rows])
 
-        for link in unused_links:
-            crud.delete_link(db, link.id)
+@celery_app.task
+def cleanup_expired_links(batch_size=CLEANUP_BATCH_SIZE):
+    logger.info("Starting cleanup of expired links")
+    condition = models.Link.__table__.c.expires_at <= datetime.utcnow()
+    return _run_cleanup("expired", condition, batch_size, TOMBSTONE_EXPIRED, before=_requeue_upcoming_expiries)
 
-        return len(unused_links)
-    finally:
-        db.close()
+async def _expire_due_links(db: Session, batch_size: int) -> dict:
+    """Удаляет ссылки, чей срок в очереди истечения уже наступил, пачками по batch_size."""
+    links = models.Link.__table__
+    started = time.monotonic()
+    deleted = 0
+    batches = 0
+    while True:
+        now = int(time.time())
+        due = await get_due_expiries(now, batch_size)
+        if not due:
+            break
+        # Срок могли продлить или ссылку уже удалить - сверяемся с БД
+        short_codes = db.scalars(
+            delete(links)
+            .where(links.c.short_code.in_(due), links.c.expires_at <= datetime.utcfromtimestamp(now))
+            .returning(links.c.short_code)
+        ).all()
+        db.commit()
+        if short_codes:
+            await delete_cached_links(short_codes, TOMBSTONE_EXPIRED)
+        await ack_expiries(due, now)
+        deleted += len(short_codes)
+        batches += 1
+    elapsed = time.monotonic() - started
+    return {
+        "deleted": deleted,
+        "batches": batches,
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(deleted / elapsed, 1) if elapsed > 0 else 0.0
+    }
 
 @celery_app.task
-def cleanup_expired_links():
-    logger.info("Starting cleanup of expired links")
+def expire_due_links(batch_size=EXPIRY_BATCH_SIZE):
     db = SessionLocal()
     try:
-        expired_links = db.query(models.Link).filter(
-            models.Link.expires_at <= datetime.utcnow()
-        ).all()
-        
-        for link in expired_links:
-            delete_cached_link(link.short_code)
-            db.delete(link)
-        
-        db.commit()
-        logger.info(f"Deleted {len(expired_links)} expired links")
-        return len(expired_links)
+        async def expire():
+            report = await _expire_due_links(db, batch_size)
+            await record_task_run("expire_due_links", report["seconds"], report["deleted"])
+            return report
+
+        report = run_async(expire())
+        if report["deleted"]:
+            logger.info(f"Expired {report['deleted']} links in {report['batches']} batches")
+        return report
     except Exception as e:
         db.rollback()
-        logger.error(f"Error cleaning up expired links: {e}")
+        logger.error(f"Error expiring due links: {e}")
         raise
     finally:
         db.close()
 
 @celery_app.task
-def cleanup_inactive_links(days=30):
+def cleanup_inactive_links(days=30, batch_size=CLEANUP_BATCH_SIZE):
     logger.info(f"Starting cleanup of inactive links (older than {days} days)")
+    return _run_cleanup(
+        "inactive", _inactive_condition(days), batch_size, TOMBSTONE_DELETED, before=_flush_before_cleanup
+    )
+
+async def _flush_click_counters(db: Session, batch_size: int, wait: float = 0) -> Optional[int]:
+    """Переносит счётчики переходов из Redis в БД. Возвращает None, если за wait секунд сброс не освободился."""
+    lock = click_flush_lock(wait)
+    if not await lock.acquire():
+        return None
+    try:
+        flushed = 0
+        async for short_codes in iter_dirty_links(batch_size):
+            # Продлеваем блокировку на каждую пачку; если она уже истекла и перехвачена, сброс прерывается
+            await lock.reacquire()
+            pending = await get_pending_clicks(short_codes)
+            clicked = [item for item in pending if item["access_count"] > 0]
+            if clicked:
+                crud.apply_click_counts(db, clicked)
+            await ack_flushed_clicks(pending)
+            flushed += sum(item["access_count"] for item in clicked)
+        return flushed
+    finally:
+        await lock.release()
+
+@celery_app.task
+def flush_click_counters(batch_size=500):
     db = SessionLocal()
     try:
-        cutoff_date = datetime.utcnow() - timedelta(days=days)
-        
-        inactive_links = db.query(models.Link).filter(
-            models.Link.last_accessed <= cutoff_date
+        async def flush():
+            started = time.monotonic()
+            flushed = await _flush_click_counters(db, batch_size)
+            await record_task_run("flush_click_counters", time.monotonic() - started)
+            return flushed
+
+        flushed = run_async(flush())
+        if flushed is None:
+            logger.info("Click counters are being flushed by another worker, skipping")
+            return 0
+        logger.info(f"Flushed {flushed} clicks to the database")
+        return flushed
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Error flushing click counters: {e}")
+        raise
+    finally:
+        db.close()
+
+async def _iter_short_codes(db: Session, batch_size: int):
+    links = models.Link.__table__
+    last_id = 0
+    while True:
+        rows = db.execute(
+            select(links.c.id, links.c.short_code)
+            .where(links.c.id > last_id)
+            .order_by(links.c.id)
+            .limit(batch_size)
         ).all()
-        
-        for link in inactive_links:
-            delete_cached_link(link.short_code)
-            db.delete(link)
-        
-        db.commit()
-        logger.info(f"Deleted {len(inactive_links)} inactive links")
-        return len(inactive_links)
+        if not rows:
+            break
+        last_id = rows[-1].id
+        yield [row.short_code for row in rows]
+
+async def _rebuild_link_filter_locked(db: Session, batch_size: int, only_if_cold: bool) -> Optional[int]:
+    lock = link_filter_lock()
+    if not await lock.acquire():
+        return None
+    try:
+        if only_if_cold and await link_filter_ready():
+            return None
+
+        async def batches():
+            async for short_codes in _iter_short_codes(db, batch_size):
+                # Перестройка большой таблицы может идти дольше LINK_FILTER_LOCK_TTL
+                await lock.reacquire()
+                yield short_codes
+
+        return await rebuild_link_filter(batches())
+    finally:
+        await lock.release()
+
+@celery_app.task
+def rebuild_short_code_filter(batch_size=CLEANUP_BATCH_SIZE, only_if_cold=False):
+    db = SessionLocal()
+    try:
+        total = run_async(_rebuild_link_filter_locked(db, batch_size, only_if_cold))
+        if total is None:
+            logger.info("Short code filter is already built or being rebuilt, skipping")
+            return 0
+        logger.info(f"Rebuilt short code filter with {total} codes")
+        return total
+    except Exception as e:
+        logger.error(f"Error rebuilding short code filter: {e}")
+        raise
+    finally:
+        db.close()
+
+@worker_ready.connect
+def build_cold_short_code_filter(sender=None, **kwargs):
+    # После деплоя или потери данных Redis фильтра нет - не ждём плановой перестройки
+    rebuild_short_code_filter.delay(only_if_cold=True)
+
+@celery_app.task(bind=True)
+def warm_up_link_cache(self, top_n=WARMUP_TOP_N, recent_days=WARMUP_RECENT_DAYS, batch_size=WARMUP_BATCH_SIZE):
+    db = SessionLocal()
+    try:
+        links = [dict(row._mapping) for row in db.execute(crud.popular_links_query(top_n, recent_days))]
+    finally:
+        db.close()
+
+    def on_progress(warmed, total):
+        logger.info(f"Cache warm-up: {warmed}/{total} links")
+        if self.request.id:
+            self.update_state(state="PROGRESS", meta={"warmed": warmed, "total": total})
+
+    try:
+        async def warm():
+            report = await warm_link_cache(links, batch_size=batch_size, on_progress=on_progress)
+            await record_task_run("warm_up_link_cache", report["seconds"])
+            return report
+
+        report = run_async(warm())
+        logger.info(f"Warmed {report['warmed']} links in {report['seconds']}s ({report['links_per_second']} links/sec)")
+        return report
+    except Exception as e:
+        logger.error(f"Error warming up link cache: {e}")
+        raise
+
+@celery_app.task
+def backfill_url_hashes(batch_size=CLEANUP_BATCH_SIZE):
+    """Заполняет url_hash у ссылок, созданных до появления колонки: пачки по id, каждая - своя транзакция."""
+    links = models.Link.__table__
+    fill_hash = update(links).where(links.c.id == bindparam("link_id")).values(url_hash=bindparam("digest"))
+    db = SessionLocal()
+    started = time.monotonic()
+    updated = 0
+    last_id = 0
+    try:
+        while True:
+            rows = db.execute(
+                select(links.c.id, links.c.original_url)
+                .where(links.c.id > last_id, links.c.url_hash.is_(None), links.c.original_url.is_not(None))
+                .order_by(links.c.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            db.execute(fill_hash, [{"link_id": row.id, "digest": url_digest(row.original_url)} for row in rows])
+            db.commit()
+            updated += len(rows)
+            logger.info(f"Backfilled url_hash for {updated} links")
+        elapsed = time.monotonic() - started
+        return {
+            "updated": updated,
+            "seconds": round(elapsed, 3),
+            "rows_per_second": round(updated / elapsed, 1) if elapsed > 0 else 0.0
+        }
     except Exception as e:
         db.rollback()
-        logger.error(f"Error cleaning up inactive links: {e}")
+        logger.error(f"Error backfilling url hashes: {e}")
         raise
     finally:
-        db.close() 
\ No newline at end of file
+        db.close()
@@ -0,0 +1,18 @@
+import hashlib
+from urllib.parse import urlsplit, urlunsplit
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+def normalize_url(url: str) -> str:
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    if parts.port and DEFAULT_PORTS.get(scheme) == parts.port:
+        netloc = netloc.rsplit(":", 1)[0]
+    path = parts.path or "/"
+    return urlunsplit((scheme, netloc, path, parts.query, parts.fragment))
+
+def url_digest(url: str) -> int:
+    # 64-битный хэш нормализованного URL, знаковый - чтобы влезать в BIGINT
+    digest = hashlib.blake2b(normalize_url(url).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
@@ -0,0 +1,210 @@
+"""Микробенчмарки горячих путей без внешних сервисов.
+
+БД - общая in-memory SQLite, Redis - fakeredis в том же процессе.
+Запуск из корня репозитория:
+
+    python -m benchmarks.hot_paths                      # сравнить с benchmarks/baseline.json
+    python -m benchmarks.hot_paths --update-baseline    # перезаписать базовую линию
+    python -m benchmarks.hot_paths --output result.json --tolerance 0.5
+
+Результат - JSON с медианой и минимумом времени одной операции в микросекундах.
+Сравнивается минимум по раундам - он меньше всего зависит от шума соседних процессов.
+Если он хуже базового больше чем на tolerance, скрипт завершается с кодом 1.
+Базовая линия зависит от машины: её нужно снимать там же, где идёт сравнение.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List
+
+BASELINE_PATH = Path(__file__).with_name("baseline.json")
+DATABASE_URL = "sqlite:///file:benchdb?mode=memory&cache=shared&uri=true"
+
+def _summary(samples: List[float], number: int) -> Dict[str, Any]:
+    per_op = [sample / number * 1e6 for sample in samples]
+    return {
+        "median_us": round(statistics.median(per_op), 3),
+        "min_us": round(min(per_op), 3),
+        "rounds": len(samples),
+        "iterations": number
+    }
+
+def bench(func: Callable[[], Any], number: int, rounds: int) -> Dict[str, Any]:
+    func()
+    samples = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        samples.append(time.perf_counter() - started)
+    return _summary(samples, number)
+
+async def bench_async(func: Callable[[], Awaitable[Any]], number: int, rounds: int) -> Dict[str, Any]:
+    await func()
+    samples = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for _ in range(number):
+            await func()
+        samples.append(time.perf_counter() - started)
+    return _summary(samples, number)
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]], tolerance: float) -> List[str]:
+    """Возвращает описания регрессий: минимум хуже базового больше чем в (1 + tolerance) раз."""
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        limit = reference["min_us"] * (1 + tolerance)
+        if result["min_us"] > limit:
+            regressions.append(
+                f"{name}: {result['min_us']}us > {reference['min_us']}us "
+                f"(+{(result['min_us'] / reference['min_us'] - 1) * 100:.0f}%, tolerance {tolerance * 100:.0f}%)"
+            )
+    return regressions
+
+def use_in_process_backends(database_url: str = DATABASE_URL):
+    """Направляет приложение в database_url и fakeredis. Вызывать до первого импорта app.
+
+    Возвращает открытое соединение: общая in-memory база живёт, пока оно не закрыто.
+    """
+    # Движки создаются при импорте app.database, поэтому окружение выставляется заранее
+    os.environ["DATABASE_URL"] = database_url
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+
+    import fakeredis
+    import app.cache as cache
+    from app.database import engine
+
+    keepalive = engine.connect()
+    cache.redis_client = fakeredis.FakeAsyncRedis(decode_responses=True)
+    import app.main  # noqa: F401 - создаёт таблицы
+    return keepalive
+
+async def run(number: int, rounds: int) -> Dict[str, Dict[str, Any]]:
+    keepalive = use_in_process_backends()
+
+    import httpx
+    from datetime import datetime, timedelta
+    from sqlalchemy import insert
+
+    import app.cache as cache
+    import app.models as models
+    from app import auth
+    from app.database import AsyncSessionLocal, engine
+    from app.main import app
+    from app.shortcode import allocator
+
+    with engine.begin() as connection:
+        connection.execute(insert(models.User), [{
+            "username": "bench",
+            "email": "bench@example.com",
+            "hashed_password": auth.get_password_hash("bench-password"),
+            "is_active": True
+        }])
+        connection.execute(insert(models.Link), [
+            {"original_url": f"https://bench.example.com/{index}", "short_code": f"miss{index}", "access_count": 0}
+            for index in range(number * (rounds + 1))
+        ] + [{"original_url": "https://bench.example.com/hot", "short_code": "hot", "access_count": 0}])
+
+    token = auth.create_access_token({"sub": "bench"}, expires_delta=timedelta(minutes=30))
+    headers = {"Authorization": f"Bearer {token}"}
+    results = {}
+
+    # Номера идут подряд, как при выдаче из арендованного блока
+    numbers = itertools.count()
+    results["allocator_code_for"] = bench(lambda: allocator.code_for(next(numbers)), number * 10, rounds)
+    results["create_access_token"] = bench(
+        lambda: auth.create_access_token({"sub": "bench"}, expires_delta=timedelta(minutes=30)), number, rounds
+    )
+
+    expires_at = datetime.utcnow() + timedelta(days=1)
+    results["cache_set_link"] = await bench_async(
+        lambda: cache.set_cached_link("bench", "https://bench.example.com/", expires_at), number, rounds
+    )
+
+    async def get_from_redis():
+        cache.local_cache.invalidate("bench")
+        await cache.get_cached_link("bench")
+    results["cache_get_link_redis"] = await bench_async(get_from_redis, number, rounds)
+    results["cache_get_link_local"] = await bench_async(lambda: cache.get_cached_link("bench"), number * 10, rounds)
+
+    async with AsyncSessionLocal() as db:
+        # Пачка из 100 кодов, как в пакетном создании; блок номеров арендуется раз в block_size кодов
+        results["allocator_allocate_many_100"] = await bench_async(lambda: allocator.allocate_many(db, 100), number, rounds)
+
+        async def current_user_cold():
+            cache.token_cache.clear()
+            cache.principal_cache.clear()
+            await auth.get_current_user(token, db)
+        results["get_current_user_cold"] = await bench_async(current_user_cold, number, rounds)
+        results["get_current_user_cached"] = await bench_async(
+            lambda: auth.get_current_user(token, db), number * 10, rounds
+        )
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        results["redirect_hit"] = await bench_async(lambda: client.get("/hot"), number, rounds)
+
+        # Каждая итерация - новый код, которого ещё нет ни в одном кэше
+        miss_codes = iter(range(number * (rounds + 1)))
+        results["redirect_miss"] = await bench_async(lambda: client.get(f"/miss{next(miss_codes)}"), number, rounds)
+
+        results["create_short_link"] = await bench_async(
+            lambda: client.post("/links/shorten", json={"original_url": "https://bench.example.com/new"}, headers=headers),
+            number, rounds
+        )
+
+    await cache.close_redis()
+    keepalive.close()
+    return results
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Микробенчмарки горячих путей")
+    parser.add_argument("--number", type=int, default=200, help="итераций в раунде")
+    parser.add_argument("--rounds", type=int, default=7)
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--tolerance", type=float, default=float(os.getenv("BENCH_TOLERANCE", 0.5)))
+    parser.add_argument("--output", type=Path, help="куда сохранить результат (по умолчанию stdout)")
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args(argv)
+
+    import logging
+    logging.disable(logging.CRITICAL)
+
+    results = asyncio.run(run(args.number, args.rounds))
+    report = {"python": platform.python_version(), "machine": platform.machine(), "results": results}
+    text = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(text + "\n")
+    else:
+        print(text)
+
+    if args.update_baseline:
+        args.baseline.write_text(text + "\n")
+        print(f"Baseline written to {args.baseline}", file=sys.stderr)
+        return 0
+    if not args.baseline.exists():
+        print(f"No baseline at {args.baseline}, run with --update-baseline", file=sys.stderr)
+        return 0
+
+    baseline = json.loads(args.baseline.read_text())["results"]
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print("PERFORMANCE REGRESSION:", file=sys.stderr)
+        for line in regressions:
+            print(f"  {line}", file=sys.stderr)
+        return 1
+    print(f"No regressions against {args.baseline} (tolerance {args.tolerance * 100:.0f}%)", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,241 @@
+"""Нагрузочный сценарий с реалистичным распределением запросов.
+
+Популярность ссылок распределена по Ципфу (--zipf), чтение преобладает над записью (--mix),
+часть новых ссылок быстро истекает (--expiring), часть переходов идёт по несуществующим
+кодам, а ссылки создают авторизованные пользователи (--writers).
+
+По умолчанию приложение запускается в том же процессе (httpx + ASGI, временная SQLite
+и fakeredis), с --base-url нагрузка идёт на развёрнутый сервис:
+
+    python -m benchmarks.workload --requests 5000 --concurrency 32
+    python -m benchmarks.workload --base-url http://localhost:8000 --duration 60
+
+Отчёт - JSON с пропускной способностью и p50/p95/p99 по каждому типу запроса.
+"""
+import argparse
+import asyncio
+import bisect
+import json
+import random
+import sys
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+DEFAULT_MIX = "redirect=90,shorten=4,stats=3,search=1,probe=2"
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for part in value.split(","):
+        name, weight = part.split("=")
+        mix[name.strip()] = float(weight)
+    unknown = set(mix) - {"redirect", "shorten", "stats", "search", "probe"}
+    if unknown:
+        raise argparse.ArgumentTypeError(f"unknown request types: {', '.join(sorted(unknown))}")
+    return mix
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+class ZipfPool:
+    """Пул кодов, где код с рангом r выбирается с весом 1 / r^s.
+
+    Новые коды получают самые большие ранги: свежая ссылка холодная, пока не наберёт переходов.
+    """
+
+    def __init__(self, skew: float, rng: random.Random):
+        self.skew = skew
+        self.rng = rng
+        self.items: List[dict] = []
+        self._cumulative: List[float] = []
+
+    def add(self, item: dict) -> None:
+        total = self._cumulative[-1] if self._cumulative else 0.0
+        self.items.append(item)
+        self._cumulative.append(total + 1.0 / len(self.items) ** self.skew)
+
+    def choice(self) -> dict:
+        point = self.rng.random() * self._cumulative[-1]
+        return self.items[bisect.bisect_left(self._cumulative, point)]
+
+class Workload:
+    def __init__(self, client, args, rng: random.Random):
+        self.client = client
+        self.args = args
+        self.rng = rng
+        self.pool = ZipfPool(args.zipf, rng)
+        self.tokens: List[str] = []
+        self.kinds = list(args.mix)
+        self.weights = [args.mix[kind] for kind in self.kinds]
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.issued = 0
+
+    async def setup(self) -> None:
+        password = "workload-password"
+        for index in range(self.args.writers):
+            username = f"writer-{uuid.uuid4().hex[:8]}-{index}"
+            response = await self.client.post("/register", json={
+                "username": username, "email": f"{username}@example.com", "password": password
+            })
+            response.raise_for_status()
+            response = await self.client.post("/token", data={"username": username, "password": password})
+            response.raise_for_status()
+            self.tokens.append(response.json()["access_token"])
+        for _ in range(self.args.links):
+            await self._shorten(record=False)
+
+    def _headers(self) -> dict:
+        return {"Authorization": f"Bearer {self.rng.choice(self.tokens)}"}
+
+    async def _shorten(self, record: bool = True) -> None:
+        payload = {"original_url": f"https://{uuid.uuid4().hex[:12]}.example.com/{uuid.uuid4().hex[:8]}"}
+        # Один срок и для сервера, и для пула: иначе истёкшая на сервере ссылка считалась бы живой
+        expires_at = time.time() + self.args.expiry_seconds if self.rng.random() < self.args.expiring else None
+        if expires_at is not None:
+            payload["expires_at"] = datetime.utcfromtimestamp(expires_at).isoformat()
+        started = time.perf_counter()
+        response = await self.client.post("/links/shorten", json=payload, headers=self._headers())
+        if record:
+            self._record("shorten", started, response.status_code == 200)
+        if response.status_code == 200:
+            self.pool.add({
+                "short_code": response.json()["short_code"],
+                "original_url": payload["original_url"],
+                "expires_at": expires_at
+            })
+
+    def _record(self, kind: str, started: float, ok: bool) -> None:
+        self.latencies[kind].append(time.perf_counter() - started)
+        if not ok:
+            self.errors[kind] += 1
+
+    async def _redirect(self) -> None:
+        link = self.pool.choice()
+        started = time.perf_counter()
+        response = await self.client.get(f"/{link['short_code']}", follow_redirects=False)
+        # Истёкшие ссылки отвечают 404, это ожидаемо
+        expired = link["expires_at"] is not None and link["expires_at"] <= time.time()
+        self._record("redirect", started, response.status_code in ((307, 404) if expired else (307,)))
+
+    async def _probe(self) -> None:
+        started = time.perf_counter()
+        response = await self.client.get(f"/probe-{uuid.uuid4().hex[:10]}", follow_redirects=False)
+        self._record("probe", started, response.status_code == 404)
+
+    async def _stats(self) -> None:
+        link = self.pool.choice()
+        started = time.perf_counter()
+        response = await self.client.get(f"/links/{link['short_code']}/stats")
+        self._record("stats", started, response.status_code in (200, 404))
+
+    async def _search(self) -> None:
+        link = self.pool.choice()
+        started = time.perf_counter()
+        response = await self.client.get("/links/search", params={"original_url": link["original_url"]})
+        self._record("search", started, response.status_code in (200, 404))
+
+    async def worker(self, deadline: Optional[float]) -> None:
+        handlers = {
+            "redirect": self._redirect,
+            "shorten": self._shorten,
+            "stats": self._stats,
+            "search": self._search,
+            "probe": self._probe
+        }
+        while True:
+            if deadline is not None and time.perf_counter() >= deadline:
+                return
+            if deadline is None:
+                if self.issued >= self.args.requests:
+                    return
+                self.issued += 1
+            kind = self.rng.choices(self.kinds, weights=self.weights)[0]
+            await handlers[kind]()
+
+    async def run(self) -> dict:
+        started = time.perf_counter()
+        deadline = started + self.args.duration if self.args.duration else None
+        await asyncio.gather(*(self.worker(deadline) for _ in range(self.args.concurrency)))
+        elapsed = time.perf_counter() - started
+        return self.report(elapsed)
+
+    def report(self, elapsed: float) -> dict:
+        endpoints = {}
+        total = 0
+        for kind, values in sorted(self.latencies.items()):
+            values.sort()
+            total += len(values)
+            endpoints[kind] = {
+                "requests": len(values),
+                "errors": self.errors[kind],
+                "rps": round(len(values) / elapsed, 1),
+                "p50_ms": round(percentile(values, 0.50) * 1000, 3),
+                "p95_ms": round(percentile(values, 0.95) * 1000, 3),
+                "p99_ms": round(percentile(values, 0.99) * 1000, 3),
+                "max_ms": round(values[-1] * 1000, 3)
+            }
+        return {
+            "seconds": round(elapsed, 3),
+            "requests": total,
+            "rps": round(total / elapsed, 1),
+            "concurrency": self.args.concurrency,
+            "zipf": self.args.zipf,
+            "mix": self.args.mix,
+            "endpoints": endpoints
+        }
+
+async def main_async(args) -> dict:
+    import httpx
+
+    rng = random.Random(args.seed)
+    if args.base_url:
+        client = httpx.AsyncClient(base_url=args.base_url, timeout=30)
+    else:
+        from benchmarks.hot_paths import use_in_process_backends
+
+        # Файловая SQLite: в отличие от in-memory, она переносит одновременные записи из разных соединений
+        database_path = Path(tempfile.mkdtemp(prefix="workload-")) / "workload.db"
+        use_in_process_backends(f"sqlite:///{database_path}")
+        from app.main import app
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://workload", timeout=30)
+
+    async with client:
+        workload = Workload(client, args, rng)
+        await workload.setup()
+        return await workload.run()
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Нагрузочный сценарий с распределением Ципфа")
+    parser.add_argument("--base-url", help="адрес развёрнутого сервиса; без него приложение запускается в процессе")
+    parser.add_argument("--requests", type=int, default=5000, help="всего запросов (если не задан --duration)")
+    parser.add_argument("--duration", type=float, help="длительность в секундах")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--links", type=int, default=1000, help="ссылок, создаваемых до начала замера")
+    parser.add_argument("--writers", type=int, default=4, help="авторизованных пользователей, создающих ссылки")
+    parser.add_argument("--zipf", type=float, default=1.1, help="показатель распределения Ципфа")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX))
+    parser.add_argument("--expiring", type=float, default=0.05, help="доля новых ссылок с коротким сроком жизни")
+    parser.add_argument("--expiry-seconds", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", type=Path, help="куда сохранить отчёт (по умолчанию stdout)")
+    args = parser.parse_args(argv)
+
+    import logging
+    logging.disable(logging.CRITICAL)
+
+    report = asyncio.run(main_async(args))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(text + "\n")
+    else:
+        print(text)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
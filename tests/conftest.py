@@ -1,15 +1,27 @@
+import os
 import pytest
+import fakeredis
+from fakeredis.aioredis import FakeAsyncRedisConnection
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import StaticPool
+from sqlalchemy.pool import NullPool, StaticPool
 
-from app.main import app
-from app.database import Base, get_db
+# Прогрев при старте читал бы рабочую БД; в тестах он вызывается явно
+os.environ["CACHE_WARMUP_ON_STARTUP"] = "0"
+
+from app.main import app, link_loader
+import app.cache as cache
+from app.shortcode import allocator
+from app.database import Base, get_db, get_async_db, get_async_read_db
 import app.models as models
 from app.auth import get_password_hash
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
+# Общая in-memory база: синхронный и асинхронный движки видят одни и те же данные,
+# пока жив StaticPool-коннект синхронного движка
+SQLALCHEMY_DATABASE_URL = "sqlite:///file:testdb?mode=memory&cache=shared&uri=true"
+ASYNC_SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///file:testdb?mode=memory&cache=shared&uri=true"
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL,
@@ -18,6 +30,13 @@ engine = create_engine(
 )
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, poolclass=NullPool)
+TestingAsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+async def override_get_async_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
+
 @pytest.fixture(scope="function")
 def override_get_db():
     try:
@@ -29,9 +48,37 @@ def override_get_db():
 @pytest.fixture(scope="function", autouse=True)
 def setup_database(override_get_db):
     Base.metadata.create_all(bind=engine)
+    allocator.reset()
     yield
     Base.metadata.drop_all(bind=engine)
 
+@pytest.fixture(scope="function", autouse=True)
+def override_link_loader(monkeypatch):
+    # Загрузчик открывает свои сессии, минуя зависимость get_async_db
+    monkeypatch.setattr(link_loader, "session_factory", TestingAsyncSessionLocal)
+    monkeypatch.setattr(link_loader, "write_session_factory", TestingAsyncSessionLocal)
+
+@pytest.fixture(scope="function")
+def fake_redis_server():
+    return fakeredis.FakeServer()
+
+@pytest.fixture(scope="function", autouse=True)
+def fake_redis(monkeypatch, fake_redis_server):
+    # Приложение работает с асинхронным клиентом, тесты проверяют состояние через синхронный
+    monkeypatch.setattr(cache, "redis_client", fakeredis.FakeAsyncRedis(server=fake_redis_server, decode_responses=True))
+    # Задачи Celery создают свой пул на каждый запуск - настоящий BlockingConnectionPool, но с соединениями
+    # fakeredis (PING проверки здоровья fakeredis-соединения не проходят, поэтому она отключена)
+    create_redis_pool = cache.create_redis_pool
+    monkeypatch.setattr(cache, "create_redis_pool", lambda: create_redis_pool(
+        connection_class=FakeAsyncRedisConnection, server=fake_redis_server, health_check_interval=0
+    ))
+    redis_client = fakeredis.FakeRedis(server=fake_redis_server, decode_responses=True)
+    yield redis_client
+    redis_client.flushall()
+    cache.local_cache.clear()
+    cache.token_cache.clear()
+    cache.principal_cache.clear()
+
 @pytest.fixture(scope="session")
 def test_user_data():
     return {
@@ -57,6 +104,8 @@ def db_user(override_get_db, test_user_data):
 @pytest.fixture(scope="function")
 def client(override_get_db):
     app.dependency_overrides[get_db] = lambda: override_get_db
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    app.dependency_overrides[get_async_read_db] = override_get_async_db
     with TestClient(app) as test_client:
         yield test_client
     app.dependency_overrides.clear()
@@ -64,6 +113,8 @@ def client(override_get_db):
 @pytest.fixture(scope="function")
 def auth_client(override_get_db, test_user_data, db_user):
     app.dependency_overrides[get_db] = lambda: override_get_db
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    app.dependency_overrides[get_async_read_db] = override_get_async_db
 
     with TestClient(app) as authenticated_test_client:
         response = authenticated_test_client.post(
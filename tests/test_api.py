@@ -1,9 +1,16 @@
 from fastapi.testclient import TestClient
+import json
+import math
+import time
 import pytest 
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 
-from app.main import app
+from app.main import app, allocator
 from app.database import get_db
+import app.models as models
+import app.cache as cache
+import app.auth as auth
+from passlib.context import CryptContext
 
 def test_health_check(client: TestClient):
     response = client.get("/test")
@@ -52,6 +59,23 @@ def test_get_link_stats(auth_client: TestClient):
     assert stats_data["access_count"] >= 1 
     assert "last_accessed" in stats_data 
 
+def test_cached_redirect_counts_clicks(auth_client: TestClient, fake_redis):
+    original_url = "https://cached-redirect.com/path"
+    create_response = auth_client.post("/links/shorten", json={"original_url": original_url})
+    assert create_response.status_code == 200
+    short_code = create_response.json()["short_code"]
+
+    for _ in range(3):
+        redirect_response = auth_client.get(f"/{short_code}", follow_redirects=False)
+        assert redirect_response.status_code == 307
+        assert redirect_response.headers["location"] == original_url
+
+    assert fake_redis.hget(f"link:{short_code}:clicks", "count") == "3"
+    assert fake_redis.hgetall(f"link:{short_code}") == {"url": original_url}
+    stats_response = auth_client.get(f"/links/{short_code}/stats")
+    assert stats_response.json()["access_count"] == 3
+    assert stats_response.json()["last_accessed"] is not None
+
 def test_delete_link(auth_client: TestClient):
     original_url = "https://to-be-deleted.com/delete/me"
 
@@ -73,6 +97,17 @@ def test_get_nonexistent_link(client: TestClient):
     response = client.get("/nonexistentcode", follow_redirects=False)
     assert response.status_code == 404
 
+def test_create_links_get_distinct_codes(auth_client: TestClient, override_get_db):
+    short_codes = set()
+    for index in range(5):
+        response = auth_client.post("/links/shorten", json={"original_url": f"https://distinct-{index}.com"})
+        assert response.status_code == 200
+        short_codes.add(response.json()["short_code"])
+    assert len(short_codes) == 5
+
+    sequence = override_get_db.query(models.ShortCodeSequence).one()
+    assert sequence.next_value == 1000
+
 def test_create_link_with_existing_alias(auth_client: TestClient):
     original_url_1 = "https://first-url.com"
     original_url_2 = "https://second-url.com"
@@ -91,6 +126,71 @@ def test_create_link_with_existing_alias(auth_client: TestClient):
     assert response2.status_code == 400
     assert "Custom alias already in use" in response2.json().get("detail", "")
 
+def test_alias_cannot_take_generated_code(auth_client: TestClient):
+    # Псевдоним из алфавита счётчика позже совпал бы с выданным кодом
+    response = auth_client.post(
+        "/links/shorten", json={"original_url": "https://squatter.com", "custom_alias": allocator.code_for(0)}
+    )
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Custom alias looks like a generated code"
+
+    batch_response = auth_client.post("/links/shorten/batch", json={"links": [
+        {"original_url": "https://squatter.com", "custom_alias": allocator.code_for(1)}
+    ]})
+    assert batch_response.json()["results"][0]["error"] == "Custom alias looks like a generated code"
+
+    for _ in range(2):
+        assert auth_client.post("/links/shorten", json={"original_url": "https://plain.com"}).status_code == 200
+    # Обычные алиасы из букв и цифр счётчику не принадлежат
+    for alias in ("abc12", "summer", "promo2024"):
+        assert auth_client.post(
+            "/links/shorten", json={"original_url": "https://alias.com", "custom_alias": alias}
+        ).status_code == 200
+
+def test_generated_codes_skip_legacy_random_codes(auth_client: TestClient, override_get_db):
+    # Старые случайные коды длиной 6 символов не пересекаются с кодами счётчика
+    legacy_code = allocator.code_for(0)[:6]
+    override_get_db.add(models.Link(original_url="https://legacy.com", short_code=legacy_code, access_count=0))
+    override_get_db.commit()
+
+    response = auth_client.post("/links/shorten", json={"original_url": "https://fresh.com"})
+    assert response.status_code == 200
+    assert len(response.json()["short_code"]) == 7
+
+def test_create_links_batch(auth_client: TestClient):
+    auth_client.post("/links/shorten", json={"original_url": "https://taken.com", "custom_alias": "taken-alias"})
+
+    response = auth_client.post("/links/shorten/batch", json={"links": [
+        {"original_url": "https://batch-1.com"},
+        {"original_url": "https://batch-2.com", "custom_alias": "batch-alias"},
+        {"original_url": "https://batch-3.com", "custom_alias": "taken-alias"},
+        {"original_url": "https://batch-4.com", "custom_alias": "batch-alias"},
+        {"original_url": "https://batch-5.com"},
+    ]})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["created"] == 3
+    assert data["failed"] == 2
+
+    results = data["results"]
+    assert [item["index"] for item in results] == [0, 1, 2, 3, 4]
+    assert results[1]["short_code"] == "batch-alias"
+    assert results[2]["error"] == "Custom alias already in use"
+    assert results[3]["error"] == "Custom alias already in use"
+    assert results[0]["short_code"] != results[4]["short_code"]
+
+    for item in (results[0], results[1], results[4]):
+        redirect_response = auth_client.get(f"/{item['short_code']}", follow_redirects=False)
+        assert redirect_response.status_code == 307
+        assert redirect_response.headers["location"] == item["original_url"]
+
+    search_response = auth_client.get("/links/search", params={"original_url": "https://batch-5.com"})
+    assert search_response.json()["short_code"] == results[4]["short_code"]
+
+def test_create_links_batch_unauthenticated(client: TestClient):
+    response = client.post("/links/shorten/batch", json={"links": [{"original_url": "https://batch.com"}]})
+    assert response.status_code == 401
+
 def test_delete_link_unauthenticated(client: TestClient, auth_client: TestClient):
     original_url = "https://delete-unauth-test.com"
     create_response = auth_client.post("/links/shorten", json={"original_url": original_url})
@@ -128,6 +228,23 @@ def test_update_link(auth_client: TestClient):
     assert redirect_response.status_code == 307
     assert redirect_response.headers["location"] == new_url
 
+def test_update_link_invalidates_local_cache(auth_client: TestClient):
+    create_response = auth_client.post("/links/shorten", json={"original_url": "https://before-update.com"})
+    short_code = create_response.json()["short_code"]
+
+    for _ in range(2):
+        redirect_response = auth_client.get(f"/{short_code}", follow_redirects=False)
+        assert redirect_response.headers["location"] == "https://before-update.com"
+    assert auth_client.get("/cache/stats").json()["hits"] >= 1
+
+    auth_client.put(f"/links/{short_code}", json={"original_url": "https://after-update.com"})
+
+    redirect_response = auth_client.get(f"/{short_code}", follow_redirects=False)
+    assert redirect_response.headers["location"] == "https://after-update.com"
+
+    stats_response = auth_client.get(f"/links/{short_code}/stats")
+    assert stats_response.json()["access_count"] == 3
+
 def test_update_nonexistent_link(auth_client: TestClient):
     update_response = auth_client.put(
         "/links/nonexistentcode",
@@ -159,6 +276,39 @@ def test_list_links(auth_client: TestClient):
     assert "https://link1.com" in urls_in_response
     assert "https://link2.com" in urls_in_response
 
+def test_list_links_keyset_pagination(auth_client: TestClient):
+    urls = [f"https://page-{index}.com" for index in range(5)]
+    auth_client.post("/links/shorten/batch", json={"links": [{"original_url": url} for url in urls]})
+
+    seen = []
+    params = {"limit": 2}
+    while True:
+        response = auth_client.get("/links", params=params)
+        assert response.status_code == 200
+        page = response.json()
+        assert len(page) <= 2
+        seen.extend(item["original_url"] for item in page)
+        if "x-next-cursor" not in response.headers:
+            break
+        params["cursor"] = response.headers["x-next-cursor"]
+    assert seen == urls
+
+    response = auth_client.get("/links", params={"limit": 2}, headers={"Origin": "https://app.example.com"})
+    assert "x-next-cursor" in response.headers["access-control-expose-headers"].lower()
+
+    assert auth_client.get("/links", params={"limit": 100000}).status_code == 422
+
+def test_export_links_ndjson(auth_client: TestClient):
+    urls = [f"https://export-{index}.com" for index in range(3)]
+    auth_client.post("/links/shorten/batch", json={"links": [{"original_url": url} for url in urls]})
+
+    response = auth_client.get("/links/export")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["original_url"] for row in rows] == urls
+    assert all("access_count" in row and "short_code" in row for row in rows)
+
 def test_search_link(auth_client: TestClient):
     search_url = "https://search-for-this.com/unique-path"
     create_response = auth_client.post("/links/shorten", json={"original_url": search_url})
@@ -171,11 +321,32 @@ def test_search_link(auth_client: TestClient):
     assert search_data["original_url"] == search_url
     assert search_data["short_code"] == short_code
 
+def test_search_link_normalizes_url(auth_client: TestClient):
+    create_response = auth_client.post("/links/shorten", json={"original_url": "https://Search-Normalized.com:443"})
+    short_code = create_response.json()["short_code"]
+
+    search_response = auth_client.get("/links/search", params={"original_url": "https://search-normalized.com/"})
+    assert search_response.status_code == 200
+    assert search_response.json()["short_code"] == short_code
+
+def test_create_short_link_dedupe(auth_client: TestClient):
+    original_url = "https://dedupe-me.com/path"
+    first = auth_client.post("/links/shorten", json={"original_url": original_url}).json()
+
+    deduped = auth_client.post("/links/shorten?dedupe=true", json={"original_url": original_url})
+    assert deduped.status_code == 200
+    assert deduped.json()["short_code"] == first["short_code"]
+
+    duplicate = auth_client.post("/links/shorten", json={"original_url": original_url})
+    assert duplicate.json()["short_code"] != first["short_code"]
+
+    other = auth_client.post("/links/shorten?dedupe=true", json={"original_url": "https://dedupe-me.com/other"})
+    assert other.json()["short_code"] != first["short_code"]
+
 def test_search_nonexistent_link(auth_client: TestClient):
     search_response = auth_client.get("/links/search?original_url=https://this-does-not-exist.com")
     assert search_response.status_code == 404
 
-@pytest.mark.skip(reason="Temporarily skipping due to 404 error in test environment")
 def test_get_all_links(auth_client: TestClient):
     auth_client.post("/links/shorten", json={"original_url": "https://all-link-1.com"})
     auth_client.post("/links/shorten", json={"original_url": "https://all-link-2.com"})
@@ -237,4 +408,209 @@ def test_read_users_me_invalid_token(client: TestClient):
         "/users/me", 
         headers={"Authorization": "Bearer invalidtoken"}
     )
-    assert response.status_code == 401
\ No newline at end of file
+    assert response.status_code == 401
+
+def test_new_links_pass_filter_when_caching_fails(auth_client: TestClient, fake_redis, monkeypatch):
+    import app.main as main
+    from redis.exceptions import RedisError
+
+    # Фильтр уже построен, а запись новой ссылки в кэш после коммита падает
+    fake_redis.setbit(cache.LINK_FILTER_KEY, cache.link_filter.size - 1, 0)
+    async def fail(*args, **kwargs):
+        raise RedisError("cache write failed")
+    monkeypatch.setattr(main, "set_cached_link", fail)
+    monkeypatch.setattr(main, "set_cached_links", fail)
+
+    create_response = auth_client.post("/links/shorten", json={"original_url": "https://unfiltered.com"})
+    assert create_response.status_code == 200
+    batch_response = auth_client.post("/links/shorten/batch", json={"links": [{"original_url": "https://unfiltered-batch.com"}]})
+    assert batch_response.json()["created"] == 1
+
+    for short_code in (create_response.json()["short_code"], batch_response.json()["results"][0]["short_code"]):
+        assert not fake_redis.exists(f"link:{short_code}")
+        assert auth_client.get(f"/{short_code}", follow_redirects=False).status_code == 307
+
+def test_deleted_and_unknown_codes_are_remembered(auth_client: TestClient, fake_redis):
+    create_response = auth_client.post("/links/shorten", json={"original_url": "https://tombstone.com"})
+    short_code = create_response.json()["short_code"]
+
+    assert auth_client.delete(f"/links/{short_code}").status_code == 200
+    assert fake_redis.get(f"link:{short_code}:gone") == "deleted"
+    assert auth_client.get(f"/{short_code}", follow_redirects=False).status_code == 404
+
+    assert auth_client.get("/unknown-1", follow_redirects=False).status_code == 404
+    assert fake_redis.get("link:unknown-1:gone") == "missing"
+    assert fake_redis.ttl("link:unknown-1:gone") <= 60
+
+    create_response = auth_client.post(
+        "/links/shorten", json={"original_url": "https://tombstone.com", "custom_alias": "unknown-1"}
+    )
+    assert create_response.status_code == 200
+    assert not fake_redis.exists("link:unknown-1:gone")
+    assert auth_client.get("/unknown-1", follow_redirects=False).status_code == 307
+
+def test_current_user_is_cached_until_invalidated(auth_client: TestClient, override_get_db, db_user):
+    assert auth_client.get("/users/me").status_code == 200
+    assert cache.principal_cache.get(db_user.username).id == db_user.id
+
+    db_user.is_active = False
+    override_get_db.commit()
+    assert auth_client.get("/users/me").status_code == 200
+
+    auth_client.portal.call(cache.invalidate_principal, db_user.username)
+    response = auth_client.get("/users/me")
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Inactive user"
+
+def test_login_rehashes_password_when_cost_changes(client: TestClient, override_get_db, db_user, test_user_data, monkeypatch):
+    monkeypatch.setattr(auth, "pwd_context", CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=4))
+    response = client.post(
+        "/token", data={"username": test_user_data["username"], "password": test_user_data["password"]}
+    )
+    assert response.status_code == 200
+
+    override_get_db.refresh(db_user)
+    assert db_user.hashed_password.startswith("$2b$04$")
+    assert auth.verify_password(test_user_data["password"], db_user.hashed_password)
+
+def test_login_rejected_when_hash_queue_is_full(client: TestClient, db_user, test_user_data, monkeypatch):
+    monkeypatch.setattr(auth, "PASSWORD_HASH_MAX_PENDING", 0)
+    response = client.post(
+        "/token", data={"username": test_user_data["username"], "password": test_user_data["password"]}
+    )
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+
+def test_link_analytics(auth_client: TestClient, fake_redis):
+    create_response = auth_client.post("/links/shorten", json={"original_url": "https://analytics.com"})
+    short_code = create_response.json()["short_code"]
+
+    for user_agent in ["agent-a", "agent-b", "agent-a"]:
+        auth_client.get(f"/{short_code}", headers={"User-Agent": user_agent}, follow_redirects=False)
+
+    response = auth_client.get(f"/links/{short_code}/analytics")
+    assert response.status_code == 200
+    data = response.json()
+    assert data["unique_visitors"] == 2
+    assert len(data["minutes"]) == 60
+    assert len(data["hours"]) == 48
+    assert len(data["days"]) == 90
+    for series in ("minutes", "hours", "days"):
+        assert sum(bucket["clicks"] for bucket in data[series]) == 3
+        assert data[series][-1]["clicks"] == 3
+
+    # Новый минутный бакет вытесняет вышедшие из окна
+    fake_redis.hset(f"link:{short_code}:m", "60", 5)
+    auth_client.portal.call(cache.record_click, short_code, int(time.time()) + 60)
+    assert not fake_redis.hexists(f"link:{short_code}:m", "60")
+    assert fake_redis.hlen(f"link:{short_code}:m") == 2
+
+    auth_client.delete(f"/links/{short_code}")
+    assert not fake_redis.exists(f"link:{short_code}:d", f"link:{short_code}:visitors")
+    assert auth_client.get(f"/links/{short_code}/analytics").status_code == 404
+
+def test_metrics_endpoint(auth_client: TestClient, fake_redis):
+    create_response = auth_client.post("/links/shorten", json={"original_url": "https://metrics.com"})
+    short_code = create_response.json()["short_code"]
+    auth_client.get(f"/{short_code}", follow_redirects=False)
+    fake_redis.sadd("metrics:tasks", "cleanup_expired_links")
+    fake_redis.hset("metrics:tasks:cleanup_expired_links", mapping={"runs": 2, "seconds": 0.5, "deleted": 7})
+
+    response = auth_client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    body = response.text
+    assert 'http_request_duration_seconds_count{method="GET",route="/{short_code}"}' in body
+    assert 'http_requests_total{method="POST",route="/links/shorten",status="200"}' in body
+    assert 'cache_lookups_total{op="resolve_redirect",result="local_hit"}' in body
+    assert 'celery_task_rows_deleted_total{task="cleanup_expired_links"} 7' in body
+
+def test_cached_redirect_skips_app(auth_client: TestClient, fake_redis, monkeypatch):
+    from app.database import get_async_db
+
+    create_response = auth_client.post("/links/shorten", json={"original_url": "https://fastpath.com/a b"})
+    short_code = create_response.json()["short_code"]
+    assert auth_client.get(f"/{short_code}", follow_redirects=False).status_code == 307
+
+    # Из кэша переход обслуживается без зависимостей: сессия БД не открывается
+    def no_db():
+        raise AssertionError("DB session opened for a cached redirect")
+    monkeypatch.setitem(app.dependency_overrides, get_async_db, no_db)
+
+    response = auth_client.get(f"/{short_code}", follow_redirects=False)
+    assert response.status_code == 307
+    assert response.headers["location"] == "https://fastpath.com/a%20b"
+    assert auth_client.head(f"/{short_code}", follow_redirects=False).status_code == 307
+    assert fake_redis.hget(f"link:{short_code}:clicks", "count") == "3"
+
+    fake_redis.set("link:gone1:gone", "expired")
+    response = auth_client.get("/gone1", follow_redirects=False)
+    assert response.status_code == 404
+    assert response.json() == {"detail": "Link has expired"}
+
+    # Запрос с Origin идёт через приложение, чтобы получить CORS-заголовки
+    monkeypatch.delitem(app.dependency_overrides, get_async_db)
+    response = auth_client.get(f"/{short_code}", headers={"Origin": "https://example.com"}, follow_redirects=False)
+    assert response.status_code == 307
+    assert "access-control-allow-origin" in response.headers
+
+    # Пути других маршрутов fast path не перехватывает
+    assert auth_client.get("/metrics").status_code == 200
+
+def test_redirect_survives_redis_outage(auth_client: TestClient, fake_redis, monkeypatch):
+    import redis.asyncio as redis
+    from app.metrics import HTTP_REQUESTS
+
+    create_response = auth_client.post("/links/shorten", json={"original_url": "https://outage.com"})
+    short_code = create_response.json()["short_code"]
+    head_redirects = HTTP_REQUESTS.labels("HEAD", "/{short_code}", "307")
+    before = head_redirects.value
+    assert auth_client.head(f"/{short_code}", follow_redirects=False).status_code == 307
+    assert head_redirects.value - before == 1
+
+    # Redis лежит: кэш и счётчики пропускаются, ссылка берётся из БД
+    cache.local_cache.clear()
+    monkeypatch.setattr(cache, "redis_client", redis.Redis(port=1, socket_connect_timeout=0.1))
+    response = auth_client.get(f"/{short_code}", follow_redirects=False)
+    assert response.status_code == 307
+    assert response.headers["location"] == "https://outage.com"
+    response = auth_client.get(f"/{short_code}", headers={"Origin": "https://example.com"}, follow_redirects=False)
+    assert response.status_code == 307
+    assert auth_client.get("/nothing-here", follow_redirects=False).status_code == 404
+
+def test_startup_warm_up_fills_caches(client: TestClient, override_get_db, fake_redis, monkeypatch):
+    import app.main as main
+    from tests.conftest import TestingAsyncSessionLocal
+
+    monkeypatch.setattr(main, "AsyncReadSessionLocal", TestingAsyncSessionLocal)
+    override_get_db.add_all([
+        models.Link(original_url=f"https://warm-{index}.com", short_code=f"warm{index}", access_count=index,
+                    last_accessed=datetime.utcnow())
+        for index in range(3)
+    ])
+    override_get_db.commit()
+
+    client.portal.call(main.warm_up_cache)
+    assert fake_redis.hget("link:warm2", "url") == "https://warm-2.com"
+    assert cache.local_cache.get("warm2") == ("https://warm-2.com", None)
+
+def test_cache_ttl_follows_link_expiry(auth_client: TestClient, fake_redis):
+    expires_at = datetime.utcnow() + timedelta(minutes=10)
+    create_response = auth_client.post(
+        "/links/shorten", json={"original_url": "https://short-lived.com", "expires_at": expires_at.isoformat()}
+    )
+    short_code = create_response.json()["short_code"]
+    # Срок округляется вверх до секунды
+    assert 0 < fake_redis.ttl(f"link:{short_code}") <= 601
+    # Иначе проверка exp <= now в кэше сочла бы ссылку истёкшей раньше, чем в БД
+    assert fake_redis.hget(f"link:{short_code}", "exp") == str(math.ceil(expires_at.replace(tzinfo=timezone.utc).timestamp()))
+    assert fake_redis.zscore("links:expiry", short_code) == math.ceil(expires_at.replace(tzinfo=timezone.utc).timestamp())
+
+    create_response = auth_client.post("/links/shorten", json={"original_url": "https://long-lived.com"})
+    other_code = create_response.json()["short_code"]
+    assert fake_redis.ttl(f"link:{other_code}") > 600
+    assert fake_redis.zscore("links:expiry", other_code) is None
+
+    new_expiry = datetime.utcnow() + timedelta(days=1)
+    auth_client.put(f"/links/{short_code}", json={"expires_at": new_expiry.isoformat()})
+    assert fake_redis.zscore("links:expiry", short_code) == math.ceil(new_expiry.replace(tzinfo=timezone.utc).timestamp())
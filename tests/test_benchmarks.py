@@ -0,0 +1,31 @@
+import random
+
+from benchmarks.hot_paths import compare
+from benchmarks.workload import ZipfPool, percentile
+
+def test_compare_reports_only_regressions_beyond_tolerance():
+    baseline = {
+        "redirect_hit": {"median_us": 100.0, "min_us": 90.0},
+        "redirect_miss": {"median_us": 300.0, "min_us": 280.0},
+    }
+    results = {
+        "redirect_hit": {"median_us": 125.0, "min_us": 110.0},
+        "redirect_miss": {"median_us": 500.0, "min_us": 450.0},
+        "create_short_link": {"median_us": 900.0, "min_us": 800.0},
+    }
+    regressions = compare(results, baseline, tolerance=0.3)
+    assert len(regressions) == 1
+    assert regressions[0].startswith("redirect_miss:")
+
+def test_zipf_pool_prefers_low_ranks():
+    pool = ZipfPool(skew=1.2, rng=random.Random(7))
+    for index in range(100):
+        pool.add({"short_code": f"code{index}"})
+    picks = [pool.choice()["short_code"] for _ in range(5000)]
+    assert picks.count("code0") > picks.count("code1") > picks.count("code50")
+
+def test_percentile_uses_nearest_rank():
+    values = [float(value) for value in range(1, 101)]
+    assert percentile(values, 0.50) == 50.0
+    assert percentile(values, 0.99) == 99.0
+    assert percentile([5.0], 0.95) == 5.0
@@ -0,0 +1,71 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool, StaticPool
+
+import app.models as models
+from app.cache import invalidate_cached_link
+from app.database import Base, engine_options, get_async_read_db
+from app.main import app, link_loader
+
+REPLICA_URL = "sqlite:///file:replicadb?mode=memory&cache=shared&uri=true"
+ASYNC_REPLICA_URL = "sqlite+aiosqlite:///file:replicadb?mode=memory&cache=shared&uri=true"
+
+@pytest.fixture(scope="function")
+def replica(monkeypatch):
+    # Отдельная база в роли реплики: строки в неё попадают только явно, как при отставании репликации
+    replica_engine = create_engine(REPLICA_URL, connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=replica_engine)
+    ReplicaSessionLocal = async_sessionmaker(
+        create_async_engine(ASYNC_REPLICA_URL, poolclass=NullPool), autoflush=False, expire_on_commit=False
+    )
+
+    async def get_replica_db():
+        async with ReplicaSessionLocal() as db:
+            yield db
+
+    monkeypatch.setitem(app.dependency_overrides, get_async_read_db, get_replica_db)
+    monkeypatch.setattr(link_loader, "session_factory", ReplicaSessionLocal)
+    yield replica_engine
+    Base.metadata.drop_all(bind=replica_engine)
+    replica_engine.dispose()
+
+def test_engine_options():
+    options = engine_options("postgresql+asyncpg://user:password@db/shortener")
+    assert set(options) == {"pool_size", "max_overflow", "pool_timeout", "pool_recycle", "pool_pre_ping"}
+    assert engine_options("sqlite:///./url_shortener.db") == {"connect_args": {"check_same_thread": False}}
+
+def test_reads_go_to_replica(auth_client: TestClient, override_get_db, replica):
+    override_get_db.add(models.Link(original_url="https://primary.com", short_code="primary1", access_count=0))
+    override_get_db.commit()
+
+    # Статистика читается с реплики, куда ссылка ещё не доехала
+    assert auth_client.get("/links/primary1/stats").status_code == 404
+    with replica.begin() as connection:
+        connection.execute(models.Link.__table__.insert(), [
+            {"original_url": "https://primary.com", "short_code": "primary1", "access_count": 7}
+        ])
+    assert auth_client.get("/links/primary1/stats").json()["access_count"] == 7
+
+    # Переход по только что созданной ссылке перепроверяется в основной БД
+    create_response = auth_client.post("/links/shorten", json={"original_url": "https://fresh.com"})
+    short_code = create_response.json()["short_code"]
+    assert override_get_db.query(models.Link).filter(models.Link.short_code == short_code).first() is not None
+    auth_client.portal.call(invalidate_cached_link, short_code)
+    response = auth_client.get(f"/{short_code}", follow_redirects=False)
+    assert response.status_code == 307
+    assert response.headers["location"] == "https://fresh.com"
+
+def test_update_is_not_undone_by_replica(auth_client: TestClient, override_get_db, fake_redis, replica):
+    short_code = auth_client.post("/links/shorten", json={"original_url": "https://before.com"}).json()["short_code"]
+    # Реплика ещё не получила изменение и отдаёт старый адрес
+    with replica.begin() as connection:
+        connection.execute(models.Link.__table__.insert(), [
+            {"original_url": "https://before.com", "short_code": short_code, "access_count": 0}
+        ])
+
+    assert auth_client.put(f"/links/{short_code}", json={"original_url": "https://after.com"}).status_code == 200
+    assert fake_redis.hget(f"link:{short_code}", "url") == "https://after.com"
+    response = auth_client.get(f"/{short_code}", follow_redirects=False)
+    assert response.headers["location"] == "https://after.com"
@@ -0,0 +1,48 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import app.models as models
+from app.cache import LINK_EXPIRED, LINK_NOT_FOUND
+from app.main import link_loader
+from app.metrics import LINK_LOADER_REQUESTS
+
+def test_concurrent_misses_share_one_query(client: TestClient, override_get_db, fake_redis):
+    override_get_db.add_all([
+        models.Link(original_url="https://hot.com", short_code="hot", access_count=0),
+        models.Link(original_url="https://warm.com", short_code="warm", access_count=0),
+        models.Link(
+            original_url="https://old.com", short_code="old", access_count=0,
+            expires_at=datetime.utcnow() - timedelta(hours=1)
+        )
+    ])
+    override_get_db.commit()
+
+    coalesced = LINK_LOADER_REQUESTS.labels("coalesced").value
+    queued = LINK_LOADER_REQUESTS.labels("queued").value
+    statements = []
+    def count_statement(*args):
+        statements.append(args[2])
+
+    async def load_all():
+        codes = ["hot"] * 5 + ["warm", "old", "nope"]
+        return await asyncio.gather(*(link_loader.load(code) for code in codes))
+
+    event.listen(Engine, "before_cursor_execute", count_statement)
+    try:
+        results = client.portal.call(load_all)
+    finally:
+        event.remove(Engine, "before_cursor_execute", count_statement)
+
+    assert results == ["https://hot.com"] * 5 + ["https://warm.com", LINK_EXPIRED, LINK_NOT_FOUND]
+    assert len([statement for statement in statements if statement.lstrip().startswith("SELECT")]) == 1
+    assert LINK_LOADER_REQUESTS.labels("coalesced").value - coalesced == 4
+    assert LINK_LOADER_REQUESTS.labels("queued").value - queued == 4
+
+    assert fake_redis.hget("link:hot", "url") == "https://hot.com"
+    assert fake_redis.get("link:old:gone") == "expired"
+    assert fake_redis.get("link:nope:gone") == "missing"
+    assert override_get_db.query(models.Link).filter(models.Link.short_code == "old").first() is None
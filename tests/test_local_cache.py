@@ -0,0 +1,45 @@
+import time
+
+from app.local_cache import LocalCache
+
+def test_local_cache_get_set_and_ttl():
+    local_cache = LocalCache(maxsize=10, ttl=60)
+    assert local_cache.get("abc") is None
+
+    local_cache.set("abc", ("https://example.com", None))
+    assert local_cache.get("abc") == ("https://example.com", None)
+
+    local_cache.set("short", "value", ttl=0.01)
+    time.sleep(0.02)
+    assert local_cache.get("short") is None
+
+    stats = local_cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 2
+
+def test_local_cache_admission_keeps_frequent_keys():
+    local_cache = LocalCache(maxsize=2, ttl=60)
+    for key in ("hot", "warm"):
+        for _ in range(5):
+            local_cache.get(key)
+        local_cache.set(key, key)
+
+    local_cache.get("once")
+    local_cache.set("once", "once")
+    assert local_cache.get("once") is None
+    assert local_cache.stats()["rejections"] == 1
+
+    for _ in range(10):
+        local_cache.get("rising")
+    local_cache.set("rising", "rising")
+    assert local_cache.get("rising") == "rising"
+    assert local_cache.stats()["evictions"] == 1
+    assert local_cache.get("warm") == "warm"
+
+def test_local_cache_invalidate():
+    local_cache = LocalCache(maxsize=10, ttl=60)
+    local_cache.set("abc", "value")
+    local_cache.invalidate("abc")
+    local_cache.invalidate("missing")
+    assert local_cache.get("abc") is None
+    assert local_cache.stats()["invalidations"] == 1
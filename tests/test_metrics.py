@@ -0,0 +1,20 @@
+from app.metrics import Counter, Histogram
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram("test_latency_seconds", "Test latency", ("route",), buckets=(0.1, 1.0))
+    child = histogram.labels("/a")
+    for value in (0.05, 0.5, 0.5, 3.0):
+        child.observe(value)
+
+    lines = list(histogram.collect())
+    assert 'test_latency_seconds_bucket{route="/a",le="0.1"} 1' in lines
+    assert 'test_latency_seconds_bucket{route="/a",le="1.0"} 3' in lines
+    assert 'test_latency_seconds_bucket{route="/a",le="+Inf"} 4' in lines
+    assert 'test_latency_seconds_sum{route="/a"} 4.05' in lines
+    assert 'test_latency_seconds_count{route="/a"} 4' in lines
+
+def test_counter_children_are_shared():
+    counter = Counter("test_total", "Test counter", ("result",))
+    counter.labels("hit").inc()
+    counter.labels("hit").inc(2)
+    assert 'test_total{result="hit"} 3' in list(counter.collect())
@@ -0,0 +1,70 @@
+import asyncio
+import json
+import logging
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import app.main as main
+import app.profiling as profiling
+from app.metrics import MetricsMiddleware, TimedJSONResponse, add_request_time
+
+def make_app():
+    slow_app = FastAPI(default_response_class=TimedJSONResponse)
+
+    @slow_app.get("/slow/{item}")
+    async def slow(item: str):
+        add_request_time("db", 0.02)
+        await asyncio.sleep(0.05)
+        return {"item": item}
+
+    @slow_app.get("/fast")
+    async def fast():
+        return {}
+
+    slow_app.add_middleware(profiling.ProfilingMiddleware, sample_rate=1.0, slow_ms=30)
+    slow_app.add_middleware(MetricsMiddleware)
+    return slow_app
+
+def test_slow_requests_are_captured(tmp_path, monkeypatch):
+    log_path = tmp_path / "slow.log"
+    monkeypatch.setattr(profiling, "PROFILING_LOG_PATH", str(log_path))
+    monkeypatch.setattr(profiling, "_slow_log", None)
+    profiling.reset()
+    try:
+        with TestClient(make_app()) as client:
+            assert client.get("/slow/a").status_code == 200
+            assert client.get("/fast").status_code == 200
+
+        slowest = profiling.slowest_requests()
+        assert list(slowest) == ["/slow/{item}"]
+        record = slowest["/slow/{item}"][0]
+        assert record["duration_ms"] >= 30
+        assert record["phases_ms"]["db"] == 20.0
+        assert "serialization" in record["phases_ms"]
+
+        logged = json.loads(log_path.read_text().splitlines()[0])
+        assert logged["path"] == "/slow/a"
+        assert isinstance(logged["profile"], list)
+    finally:
+        for handler in logging.getLogger("app.slow_requests").handlers[:]:
+            logging.getLogger("app.slow_requests").removeHandler(handler)
+            handler.close()
+        profiling.reset()
+
+def test_slow_requests_endpoint(auth_client: TestClient, test_user_data, monkeypatch):
+    import app.auth as auth
+
+    # Обычному пользователю чужие пути и профили не отдаются
+    monkeypatch.setattr(main, "PROFILING_ENABLED", True)
+    response = auth_client.get("/admin/slow-requests")
+    assert response.status_code == 403
+    assert response.json() == {"detail": "Admin access required"}
+
+    monkeypatch.setattr(auth, "ADMIN_USERNAMES", frozenset({test_user_data["username"]}))
+    monkeypatch.setattr(main, "PROFILING_ENABLED", False)
+    assert auth_client.get("/admin/slow-requests").status_code == 404
+    monkeypatch.setattr(main, "PROFILING_ENABLED", True)
+    response = auth_client.get("/admin/slow-requests")
+    assert response.status_code == 200
+    assert response.json() == {}
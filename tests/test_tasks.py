@@ -0,0 +1,243 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import app.cache as cache
+import app.tasks as tasks
+import app.models as models
+
+def test_flush_click_counters(auth_client: TestClient, override_get_db, fake_redis, monkeypatch):
+    monkeypatch.setattr(tasks, "SessionLocal", lambda: override_get_db)
+    create_response = auth_client.post("/links/shorten", json={"original_url": "https://flush-me.com"})
+    short_code = create_response.json()["short_code"]
+
+    for _ in range(3):
+        auth_client.get(f"/{short_code}", follow_redirects=False)
+    assert fake_redis.sismember("links:dirty", short_code)
+
+    assert tasks.flush_click_counters() == 3
+
+    link = override_get_db.query(models.Link).filter(models.Link.short_code == short_code).first()
+    override_get_db.refresh(link)
+    assert link.access_count == 3
+    assert link.last_accessed is not None
+    assert not fake_redis.exists(f"link:{short_code}:clicks")
+    assert not fake_redis.sismember("links:dirty", short_code)
+
+    auth_client.get(f"/{short_code}", follow_redirects=False)
+    stats_response = auth_client.get(f"/links/{short_code}/stats")
+    assert stats_response.json()["access_count"] == 4
+
+    assert tasks.flush_click_counters() == 1
+    assert tasks.flush_click_counters() == 0
+
+def test_concurrent_flushes_count_clicks_once(auth_client: TestClient, override_get_db, fake_redis):
+    create_response = auth_client.post("/links/shorten", json={"original_url": "https://flush-twice.com"})
+    short_code = create_response.json()["short_code"]
+    for _ in range(3):
+        auth_client.get(f"/{short_code}", follow_redirects=False)
+
+    # Наложение запусков beat: два сброса чередуются на каждом обращении к Redis
+    async def flush_twice():
+        return await asyncio.gather(
+            tasks._flush_click_counters(override_get_db, 500),
+            tasks._flush_click_counters(override_get_db, 500)
+        )
+
+    assert sorted(tasks.run_async(flush_twice()), key=str) == [3, None]
+    link = override_get_db.query(models.Link).filter(models.Link.short_code == short_code).first()
+    override_get_db.refresh(link)
+    assert link.access_count == 3
+    assert not fake_redis.exists(f"link:{short_code}:clicks")
+    assert not fake_redis.exists("links:dirty:lock")
+
+def test_cleanup_expired_links_in_batches(override_get_db, fake_redis, monkeypatch):
+    monkeypatch.setattr(tasks, "SessionLocal", lambda: override_get_db)
+    now = datetime.utcnow()
+    for index in range(5):
+        override_get_db.add(models.Link(
+            original_url=f"https://expired-{index}.com",
+            short_code=f"expired{index}",
+            expires_at=now - timedelta(hours=1),
+            access_count=0
+        ))
+        fake_redis.hset(f"link:expired{index}", mapping={"url": f"https://expired-{index}.com"})
+    override_get_db.add(models.Link(
+        original_url="https://alive.com",
+        short_code="alive",
+        expires_at=now + timedelta(days=1),
+        access_count=0
+    ))
+    override_get_db.commit()
+
+    report = tasks.cleanup_expired_links(2)
+    assert report["deleted"] == 5
+    assert report["batches"] == 3
+    assert "rows_per_second" in report
+
+    remaining = [link.short_code for link in override_get_db.query(models.Link).all()]
+    assert remaining == ["alive"]
+    assert not any(fake_redis.exists(f"link:expired{index}") for index in range(5))
+    assert fake_redis.hget("metrics:tasks:cleanup_expired_links", "deleted") == "5"
+
+def test_cleanup_unused_links_uses_last_accessed(override_get_db, monkeypatch):
+    monkeypatch.setattr(tasks, "SessionLocal", lambda: override_get_db)
+    now = datetime.utcnow()
+    override_get_db.add_all([
+        models.Link(original_url="https://stale.com", short_code="stale", last_accessed=now - timedelta(days=40), access_count=1),
+        models.Link(original_url="https://fresh.com", short_code="fresh", last_accessed=now - timedelta(days=1), access_count=1),
+        models.Link(original_url="https://never.com", short_code="never", access_count=0),
+    ])
+    override_get_db.commit()
+
+    report = tasks.cleanup_unused_links()
+    assert report["deleted"] == 1
+
+    remaining = sorted(link.short_code for link in override_get_db.query(models.Link).all())
+    assert remaining == ["fresh", "never"]
+    assert override_get_db.query(models.Settings).filter(models.Settings.key == "unused_links_days").first().value == "30"
+
+def test_rebuild_short_code_filter(client: TestClient, override_get_db, fake_redis, monkeypatch):
+    monkeypatch.setattr(tasks, "SessionLocal", lambda: override_get_db)
+    override_get_db.add_all([
+        models.Link(original_url=f"https://filtered-{index}.com", short_code=f"filtered{index}", access_count=0)
+        for index in range(5)
+    ])
+    override_get_db.commit()
+
+    assert tasks.rebuild_short_code_filter(2) == 5
+    assert fake_redis.exists(cache.LINK_FILTER_KEY)
+    assert not fake_redis.exists(cache.LINK_FILTER_BUILD_KEY)
+
+    statements = []
+    def count_statement(*args):
+        statements.append(args[2])
+    event.listen(Engine, "before_cursor_execute", count_statement)
+    try:
+        response = client.get("/no-such-code", follow_redirects=False)
+    finally:
+        event.remove(Engine, "before_cursor_execute", count_statement)
+    assert response.status_code == 404
+    assert statements == []
+
+    response = client.get("/filtered3", follow_redirects=False)
+    assert response.status_code == 307
+
+def test_cold_short_code_filter_is_built_once(override_get_db, fake_redis, monkeypatch):
+    monkeypatch.setattr(tasks, "SessionLocal", lambda: override_get_db)
+    override_get_db.add(models.Link(original_url="https://cold.com", short_code="cold", access_count=0))
+    override_get_db.commit()
+
+    assert tasks.rebuild_short_code_filter(2, True) == 1
+    assert fake_redis.exists(cache.LINK_FILTER_KEY)
+    # Фильтр уже построен - проверка холодного фильтра его не трогает
+    assert tasks.rebuild_short_code_filter(2, True) == 0
+    # Идущая перестройка не даёт начать вторую
+    fake_redis.set(cache.LINK_FILTER_LOCK_KEY, "other-worker")
+    assert tasks.rebuild_short_code_filter(2) == 0
+
+def test_rebuild_keeps_codes_committed_after_scan(override_get_db, fake_redis, monkeypatch):
+    monkeypatch.setattr(tasks, "SessionLocal", lambda: override_get_db)
+    fake_redis.setbit(cache.LINK_FILTER_KEY, cache.link_filter.size - 1, 0)
+
+    async def create_during_rebuild():
+        # Код попал в фильтр до начала перестройки, а строка закоммичена уже после обхода таблицы
+        await cache.add_to_link_filter(["latecomer"])
+        await cache.rebuild_link_filter(tasks._iter_short_codes(override_get_db, 100))
+        return await cache.resolve_redirect("latecomer")
+
+    assert tasks.run_async(create_during_rebuild()) is None
+
+def test_warm_up_link_cache(override_get_db, fake_redis, monkeypatch):
+    monkeypatch.setattr(tasks, "SessionLocal", lambda: override_get_db)
+    now = datetime.utcnow()
+    override_get_db.add_all([
+        models.Link(original_url=f"https://popular-{index}.com", short_code=f"popular{index}", access_count=index)
+        for index in range(5)
+    ])
+    override_get_db.add(models.Link(
+        original_url="https://expired.com", short_code="expired", access_count=100, expires_at=now - timedelta(hours=1)
+    ))
+    override_get_db.add(models.Link(
+        original_url="https://expiring.com", short_code="expiring", access_count=50, expires_at=now + timedelta(hours=1)
+    ))
+    override_get_db.commit()
+
+    report = tasks.warm_up_link_cache(3, 0)
+    assert report["warmed"] == 3
+    assert fake_redis.hgetall("link:expiring")["url"] == "https://expiring.com"
+    assert fake_redis.hget("link:popular4", "url") == "https://popular-4.com"
+    assert fake_redis.exists("link:popular3")
+    assert not fake_redis.exists("link:popular2")
+    assert not fake_redis.exists("link:expired")
+    assert fake_redis.hget("metrics:tasks:warm_up_link_cache", "runs") == "1"
+
+    # Без переходов за последние дни ссылка не считается популярной
+    assert tasks.warm_up_link_cache(3, 7)["warmed"] == 0
+
+def test_expire_due_links(override_get_db, fake_redis, monkeypatch):
+    monkeypatch.setattr(tasks, "SessionLocal", lambda: override_get_db)
+    now = datetime.utcnow()
+    expiring = {
+        "due0": now - timedelta(seconds=5),
+        "due1": now - timedelta(seconds=1),
+        "later": now + timedelta(hours=1),
+        "extended": now + timedelta(hours=1)
+    }
+    for short_code, expires_at in expiring.items():
+        override_get_db.add(models.Link(
+            original_url=f"https://{short_code}.com", short_code=short_code, expires_at=expires_at, access_count=0
+        ))
+        fake_redis.hset(f"link:{short_code}", mapping={"url": f"https://{short_code}.com"})
+    override_get_db.commit()
+    queued_at = int(time.time())
+    fake_redis.zadd("links:expiry", {"due0": queued_at - 5, "due1": queued_at - 1, "extended": queued_at - 1})
+    fake_redis.zadd("links:expiry", {"later": queued_at + 3600, "deleted": queued_at - 1})
+
+    report = tasks.expire_due_links(2)
+    assert report["deleted"] == 2
+    assert report["batches"] == 2
+    remaining = {link.short_code for link in override_get_db.query(models.Link).all()}
+    assert remaining == {"later", "extended"}
+    assert fake_redis.get("link:due0:gone") == "expired"
+    assert not fake_redis.exists("link:due1")
+    assert fake_redis.exists("link:extended")
+    assert fake_redis.zrange("links:expiry", 0, -1) == ["later"]
+    assert fake_redis.hget("metrics:tasks:expire_due_links", "deleted") == "2"
+
+    # Полная очистка восстанавливает очередь для ближайших сроков
+    fake_redis.delete("links:expiry")
+    tasks.cleanup_expired_links()
+    assert set(fake_redis.zrange("links:expiry", 0, -1)) == {"later", "extended"}
+
+def test_warm_up_link_cache_runs_repeatedly(override_get_db, fake_redis, monkeypatch):
+    monkeypatch.setattr(tasks, "SessionLocal", lambda: override_get_db)
+    override_get_db.add_all([
+        models.Link(original_url=f"https://repeat-{index}.com", short_code=f"repeat{index}", access_count=index)
+        for index in range(20)
+    ])
+    override_get_db.commit()
+
+    # Пачки пишутся параллельно, поэтому пул Redis занят из нескольких корутин; каждый запуск - новый event loop
+    for _ in range(2):
+        assert tasks.warm_up_link_cache(20, 0, 5)["warmed"] == 20
+    assert fake_redis.hget("metrics:tasks:warm_up_link_cache", "runs") == "2"
+
+def test_backfill_url_hashes(auth_client: TestClient, override_get_db, monkeypatch):
+    monkeypatch.setattr(tasks, "SessionLocal", lambda: override_get_db)
+    for index in range(5):
+        auth_client.post("/links/shorten", json={"original_url": f"https://legacy-{index}.com"})
+    # Ссылки, созданные до появления колонки
+    override_get_db.execute(models.Link.__table__.update().values(url_hash=None))
+    override_get_db.commit()
+    assert auth_client.get("/links/search", params={"original_url": "https://legacy-3.com"}).status_code == 404
+
+    report = tasks.backfill_url_hashes(2)
+    assert report["updated"] == 5
+    assert override_get_db.query(models.Link).filter(models.Link.url_hash.is_(None)).count() == 0
+    search_response = auth_client.get("/links/search", params={"original_url": "https://legacy-3.com"})
+    assert search_response.json()["original_url"] == "https://legacy-3.com"
+    assert tasks.backfill_url_hashes(2)["updated"] == 0
@@ -1,24 +1,53 @@
-import string
+import asyncio
 import pytest
 
-from app.main import generate_short_code 
+from app.shortcode import ShortCodeAllocator, permute
 
-def test_generate_short_code_properties():
-    default_length = 6
-    short_code = generate_short_code(default_length)
+class InMemoryBlockSource:
+    def __init__(self):
+        self.next_value = 0
+        self.leases = 0
 
-    assert isinstance(short_code, str)
-    assert len(short_code) == default_length
+    async def lease(self, db, size):
+        start = self.next_value
+        self.next_value += size
+        self.leases += 1
+        return start
 
-    allowed_chars = string.ascii_letters + string.digits
-    assert all(char in allowed_chars for char in short_code)
+def test_allocator_codes_are_unique_across_blocks():
+    source = InMemoryBlockSource()
+    allocator = ShortCodeAllocator(source, block_size=10, scramble_key=b"secret")
 
-def test_generate_short_code_custom_length():
-    custom_length = 10
-    short_code = generate_short_code(custom_length)
+    async def allocate():
+        codes = [await allocator.allocate(None) for _ in range(15)]
+        codes += await allocator.allocate_many(None, 30)
+        return codes
 
-    assert isinstance(short_code, str)
-    assert len(short_code) == custom_length
+    codes = asyncio.run(allocate())
+    assert len(set(codes)) == 45
+    assert all(len(code) == 7 and allocator.owns(code) for code in codes)
+    assert source.leases == 3
 
-    allowed_chars = string.ascii_letters + string.digits
-    assert all(char in allowed_chars for char in short_code) 
\ No newline at end of file
+def test_allocator_grows_code_length():
+    allocator = ShortCodeAllocator(InMemoryBlockSource(), min_length=2)
+    first_tier = [allocator.code_for(number) for number in range(62)]
+    assert len(set(first_tier)) == 62
+    assert all(len(code) == 2 for code in first_tier)
+    assert allocator.code_for(62)[:2] == "00"
+    assert len(allocator.code_for(62 + 62 ** 2)) == 4
+
+def test_allocator_tells_its_codes_from_aliases():
+    allocator = ShortCodeAllocator(InMemoryBlockSource(), scramble_key=b"secret")
+    assert allocator.owns(allocator.code_for(0))
+    assert allocator.owns(allocator.code_for(62 ** 6 + 5))
+    # Старые случайные коды длиной 6 и обычные алиасы счётчику не принадлежат
+    assert not allocator.owns(allocator.code_for(0)[1:])
+    assert not allocator.owns("summer")
+    assert not allocator.owns("my-link")
+    # Лишь около 1/62 алфавитно-цифровых алиасов совпадает с контрольным символом
+    aliases = [f"promo{year}" for year in range(2000, 8200)]
+    assert sum(allocator.owns(alias) for alias in aliases) < len(aliases) / 31
+
+def test_permute_is_a_bijection():
+    space = 62 ** 2
+    assert sorted(permute(index, space, b"secret") for index in range(space)) == list(range(space))